@@ -0,0 +1,57 @@
+"""Compares bytes per block and encode/decode time of queue codecs with pickle.
+
+    python -m benchmarks.codec_benchmark --corpus blocks.jsonl
+"""
+import argparse
+import pickle
+import time
+
+from benchmarks.corpus import load_blocks
+from datascraper.codec import CodecError, QueueCodec
+from datascraper.fetcher import format_operation
+
+CODECS = [
+    ('pickle', 'pickle', None),
+    ('msgpack', 'msgpack', None),
+    ('msgpack+zlib', 'msgpack', 'zlib'),
+    ('msgpack+zstd', 'msgpack', 'zstd'),
+    ('msgpack+lz4', 'msgpack', 'lz4'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser('codec_benchmark')
+    parser.add_argument('--corpus', type=str, default=None, help='recorded blocks, generated if not set')
+    parser.add_argument('--count', type=int, default=1000, help='number of generated blocks')
+    args = parser.parse_args()
+
+    blocks = [[format_operation(operation) for operation in operations]
+              for operations in load_blocks(args.corpus, args.count).values()]
+
+    print('%-14s %12s %14s %14s' % ('codec', 'bytes/block', 'encode us/blk', 'decode us/blk'))
+    for name, serializer, compression in CODECS:
+        try:
+            codec = QueueCodec(serializer, compression)
+        except CodecError as e:
+            print('%-14s skipped: %s' % (name, e))
+            continue
+
+        started = time.perf_counter()
+        encoded = [codec.encode(block) for block in blocks]
+        encode_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        decoded = [codec.decode(data) for data in encoded]
+        decode_time = time.perf_counter() - started
+
+        assert pickle.dumps(decoded) == pickle.dumps(blocks), 'Codec "%s" changed blocks' % name
+        print('%-14s %12.1f %14.1f %14.1f' % (
+            name,
+            sum(len(data) for data in encoded) / len(blocks),
+            encode_time / len(blocks) * 1e6,
+            decode_time / len(blocks) * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Recorded blocks for benchmarks.
+
+Corpus is a JSON-lines file, every line is a list of operations of one block
+in `get_ops_in_block` format. Record it from a node:
+
+    python -m benchmarks.corpus --node https://api.steemit.com --start 20000000 --count 1000 -o blocks.jsonl
+"""
+import argparse
+import json
+
+import requests
+
+from benchmarks.fake_rpc import make_operations
+
+
+def load_blocks(path: str = None, count: int = 1000, start_block: int = 1) -> dict:
+    """Returns block number -> operations, from the corpus file or generated if path is not set."""
+    if not path:
+        return {block_num: make_operations(block_num) for block_num in range(start_block, start_block + count)}
+
+    blocks = {}
+    with open(path) as f:
+        for line in f:
+            operations = json.loads(line)
+            if operations:
+                blocks[operations[0]['block']] = operations
+    return blocks
+
+
+def record_blocks(node: str, start_block: int, count: int, path: str):
+    session = requests.Session()
+    with open(path, 'w') as f:
+        for block_num in range(start_block, start_block + count):
+            resp = session.post(node, data=json.dumps({
+                'jsonrpc': '2.0', 'id': block_num,
+                'method': 'condenser_api.get_ops_in_block', 'params': [block_num, False]
+            }), timeout=30)
+            resp.raise_for_status()
+            f.write(json.dumps(resp.json()['result']) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser('corpus')
+    parser.add_argument('--node', type=str, required=True)
+    parser.add_argument('--start', type=int, required=True)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('-o', '--output', type=str, required=True)
+    args = parser.parse_args()
+    record_blocks(args.node, args.start, args.count, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeNotificationServer(object):
+    """Local stub of notification API which keeps all received notifications.
+
+    Requests are delayed by `latency` seconds, the first `failures` requests are answered with `failure_status`.
+    Lists of notifications are accepted as batches.
+    """
+
+    def __init__(self, latency: float = 0, failures: int = 0, failure_status: int = 503,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.failures = failures
+        self.failure_status = failure_status
+        self.requests = 0
+        self.notifications = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s/api/v1_1/notification' % (host, port)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length))
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    server.requests += 1
+                    failed = server.requests <= server.failures
+                    if not failed:
+                        server.notifications.extend(payload if isinstance(payload, list) else [payload])
+                self.send_response(server.failure_status if failed else 201)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
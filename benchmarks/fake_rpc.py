@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GENESIS_TIME = datetime(2018, 1, 1)
+
+
+def make_operations(block_num: int, ops_per_block: int = 20) -> list:
+    """Generates operations of block in `get_ops_in_block` format."""
+    timestamp = (GENESIS_TIME + timedelta(seconds=3 * block_num)).strftime('%Y-%m-%dT%H:%M:%S')
+    operations = []
+    for index in range(ops_per_block):
+        if index % 4 == 0:
+            op = ['vote', {'voter': 'voter%s' % index, 'author': 'author%s' % (block_num % 100),
+                           'permlink': 'post-%s' % (block_num % 1000), 'weight': 10000}]
+        elif index % 4 == 1:
+            op = ['custom_json', {'required_auths': [], 'required_posting_auths': ['user%s' % index],
+                                  'id': 'follow', 'json': '["follow",{}]'}]
+        elif index % 4 == 2:
+            op = ['transfer', {'from': 'user%s' % index, 'to': 'steepshot',
+                               'amount': '1.000 STEEM', 'memo': ''}]
+        else:
+            op = ['producer_reward', {'producer': 'witness%s' % index, 'vesting_shares': '1.000000 VESTS'}]
+        operations.append({
+            'trx_id': '%040x' % (block_num * 1000 + index),
+            'block': block_num,
+            'trx_in_block': index,
+            'op_in_trx': 0,
+            'virtual_op': 0,
+            'timestamp': timestamp,
+            'op': op,
+        })
+    return operations
+
+
+def make_content(author: str, permlink: str, parent_author: str = '', parent_permlink: str = 'steepshot',
+                 replies: int = 0) -> dict:
+    """Generates post or comment of Steepshot in `get_content` format."""
+    created = GENESIS_TIME.strftime('%Y-%m-%dT%H:%M:%S')
+    amount = '1.000 SBD'
+    root_author, root_permlink = (author, permlink) if not parent_author else (parent_author, parent_permlink)
+    return {
+        'id': zlib.crc32(('%s/%s' % (author, permlink)).encode()), 'author': author, 'permlink': permlink,
+        'category': 'steepshot', 'parent_author': parent_author, 'parent_permlink': parent_permlink,
+        'title': 'Post %s' % permlink, 'body': '![image](https://example.com/%s.jpg)' % permlink,
+        'json_metadata': json.dumps({'tags': ['steepshot', 'photo'], 'app': 'steepshot/0.1'}),
+        'created': created, 'last_update': created, 'active': created, 'last_payout': created,
+        'cashout_time': created, 'max_cashout_time': created,
+        'depth': 1 if parent_author else 0, 'children': replies, 'net_rshares': 1000, 'abs_rshares': 1000,
+        'vote_rshares': 1000, 'children_abs_rshares': 0, 'total_vote_weight': 1000, 'reward_weight': 10000,
+        'author_rewards': 0, 'net_votes': 3, 'root_comment': 1, 'percent_steem_dollars': 10000,
+        'root_author': root_author, 'root_permlink': root_permlink, 'root_title': 'Post %s' % root_permlink,
+        'url': '/steepshot/@%s/%s' % (author, permlink), 'body_length': 100, 'author_reputation': 1000,
+        'total_payout_value': amount, 'curator_payout_value': amount, 'pending_payout_value': amount,
+        'total_pending_payout_value': amount, 'promoted': amount, 'max_accepted_payout': '1000000.000 SBD',
+        'allow_replies': True, 'allow_votes': True, 'allow_curation_rewards': True,
+        'beneficiaries': [{'account': 'steepshot', 'weight': 1000}], 'replies': [], 'reblogged_by': [],
+        'active_votes': [{'voter': 'voter%s' % vote, 'weight': vote, 'rshares': vote * 1000, 'percent': 10000,
+                          'reputation': 1000, 'time': created} for vote in range(3)],
+    }
+
+
+class FakeRPCServer(object):
+    """Local JSON-RPC server which answers `get_ops_in_block`, `get_dynamic_global_properties`,
+    `get_content` and `get_content_replies`.
+
+    `blocks` maps block number to list of operations, missing blocks are generated.
+    Every post is a Steepshot post with `replies_per_post` replies, replies have no replies.
+    Every HTTP request is delayed by `latency` seconds to imitate a remote node.
+    """
+
+    def __init__(self, head_block: int, latency: float = 0, blocks: dict = None,
+                 ops_per_block: int = 20, replies_per_post: int = 2, host: str = '127.0.0.1', port: int = 0):
+        self.head_block = head_block
+        self.latency = latency
+        self.blocks = blocks or {}
+        self.ops_per_block = ops_per_block
+        self.replies_per_post = replies_per_post
+        # (author, permlink) -> generated reply
+        self._replies = {}
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def _get_content(self, author: str, permlink: str) -> dict:
+        reply = self._replies.get((author, permlink))
+        if reply is not None:
+            return reply
+        return make_content(author, permlink, replies=self.replies_per_post)
+
+    def _get_content_replies(self, author: str, permlink: str) -> list:
+        if (author, permlink) in self._replies:
+            return []
+        replies = [make_content('replier%s' % index, 're-%s-%s' % (author, permlink), author, permlink)
+                   for index in range(self.replies_per_post)]
+        for reply in replies:
+            self._replies[(reply['author'], reply['permlink'])] = reply
+        return replies
+
+    def _dispatch(self, request: dict) -> dict:
+        method = request.get('method', '')
+        params = request.get('params', [])
+        if method == 'call':
+            # ["database_api", "get_content", [author, permlink]]
+            method, params = params[1], params[2]
+        if method.endswith('get_ops_in_block'):
+            block_num = params[0]
+            if block_num in self.blocks:
+                result = self.blocks[block_num]
+            else:
+                result = make_operations(block_num, self.ops_per_block)
+        elif method.endswith('get_dynamic_global_properties'):
+            result = {'head_block_number': self.head_block, 'last_irreversible_block_num': self.head_block}
+        elif method.endswith('get_content'):
+            result = self._get_content(*params)
+        elif method.endswith('get_content_replies'):
+            result = self._get_content_replies(*params)
+        else:
+            return {'jsonrpc': '2.0', 'id': request.get('id'),
+                    'error': {'code': -32601, 'message': 'Unknown method %s' % method}}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length))
+                if server.latency:
+                    time.sleep(server.latency)
+                if isinstance(payload, list):
+                    response = [server._dispatch(request) for request in payload]
+                else:
+                    response = server._dispatch(payload)
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,35 @@
+"""Measures blocks/sec of `BlockFetcher` against local fake RPC server for different window sizes.
+
+    python -m benchmarks.fetcher_benchmark --blocks 2000 --latency 0.05 --windows 1,5,10,20,50
+"""
+import argparse
+import time
+
+from benchmarks.fake_rpc import FakeRPCServer
+from datascraper.fetcher import BlockFetcher
+
+
+def run(url: str, blocks: int, window_size: int, batch_size: int) -> float:
+    fetcher = BlockFetcher([url], window_size=window_size, batch_size=min(batch_size, window_size))
+    started = time.perf_counter()
+    for _ in fetcher.history(1, blocks):
+        pass
+    return blocks / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser('fetcher_benchmark')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='delay of fake node per request, seconds')
+    parser.add_argument('--windows', type=str, default='1,5,10,20,50')
+    parser.add_argument('--batch-size', type=int, default=5)
+    args = parser.parse_args()
+
+    with FakeRPCServer(head_block=args.blocks, latency=args.latency) as server:
+        print('window  blocks/sec')
+        for window_size in [int(window) for window in args.windows.split(',')]:
+            print('%6s  %10.1f' % (window_size, run(server.url, args.blocks, window_size, args.batch_size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Shows that submitting notifications doesn't depend on latency of notification API.
+
+    python -m benchmarks.notification_benchmark --latency 0.2 --count 100 --batch-size 20
+"""
+import argparse
+import time
+from datetime import datetime
+
+from benchmarks.fake_notification import FakeNotificationServer
+from datascraper.config import Object
+from datascraper.dispatcher import NotificationDispatcher
+
+
+def make_options(url: str, batch_size: int) -> Object:
+    return Object(url=url, token='token', events={'transfer': 'TransferEvent'}, send=True, timeout=5,
+                  queue_size=10000, batch_size=batch_size, batch_interval=0.5, max_attempts=3, backoff=0.1,
+                  index_size=1000, index_ttl=60)
+
+
+def make_transfer(index: int) -> dict:
+    return {'type': 'transfer', 'from': 'user%s' % index, 'to': 'steepshot', 'amount': '1.000 STEEM',
+            'memo': '', 'timestamp': datetime.utcnow(), 'block_num': index}
+
+
+def main():
+    parser = argparse.ArgumentParser('notification_benchmark')
+    parser.add_argument('--latency', type=float, default=0.2, help='delay of notification API, seconds')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=20)
+    args = parser.parse_args()
+
+    operations = [make_transfer(index) for index in range(args.count)]
+
+    with FakeNotificationServer(latency=args.latency, failures=1) as server:
+        dispatcher = NotificationDispatcher(make_options(server.url, args.batch_size))
+        dispatcher.start()
+        started = time.perf_counter()
+        for operation in operations:
+            dispatcher.submit(operation)
+        submit_time = time.perf_counter() - started
+        while len(server.notifications) < args.count and time.perf_counter() - started < 60:
+            time.sleep(0.01)
+        delivery_time = time.perf_counter() - started
+
+    print('notifications: %s, API requests: %s' % (len(server.notifications), server.requests))
+    print('submit:   %8.1f us/notification' % (submit_time / args.count * 1e6))
+    print('delivery: %8.2f s in total (sync delivery would take >= %.2f s)' % (delivery_time,
+                                                                             args.count * args.latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Replays recorded blocks through scraper filtering and worker processing without live services.
+
+Blocks and posts are served by the in-process fake RPC server. Posts voted in blocks are inserted
+into Steepshot posts collection before the replay, so votes pass filtering and workers fetch, validate
+and write these posts and their replies. Redis is fakeredis or a local redis-server (`--redis-url`),
+Mongo is mongomock or a local mongod (`--mongo-uri`). Results may be saved and compared with a baseline
+saved before a change:
+
+    python -m benchmarks.replay_benchmark -c conf/conf.yaml --corpus blocks.jsonl --save baseline.json
+    python -m benchmarks.replay_benchmark -c conf/conf.yaml --corpus blocks.jsonl --baseline baseline.json
+"""
+import argparse
+import json
+import resource
+import time
+
+from redis import Redis
+from steepcommon.conf import APP_COLLECTIONS
+from steepcommon.enums import Application, CollectionType
+from steepcommon.mongo.storage import MongoStorage
+
+from benchmarks.corpus import load_blocks
+from benchmarks.fake_rpc import FakeRPCServer
+from datascraper.bulk import BulkWriter
+from datascraper.config import Config
+from datascraper.fetcher import BlockFetcher
+from datascraper.nodes import NodePool
+from datascraper.scraper import ScrapeProcess
+from datascraper.worker import WorkerProcess
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+LIST_NAME = 'forward_db'
+
+
+class MongomockStorage(object):
+    """Gives access to collections by attribute the same way as MongoStorage does."""
+
+    def __init__(self):
+        self.db = mongomock.MongoClient().datascraper
+
+    def __getattr__(self, name):
+        return self.db[name]
+
+
+class ReplayScraper(ScrapeProcess):
+    """Scraper which fetches blocks from fake RPC server and stops at the last block of corpus."""
+
+    def __init__(self, config: Config, redis_obj, fetcher: BlockFetcher):
+        super(ReplayScraper, self).__init__(name='ReplayScraper', config=config, redis_list_name=LIST_NAME,
+                                            redis_obj=redis_obj, reversed_mode=False)
+        self.fetcher = fetcher
+        # Workers run after the scraper, so it must never wait for them
+        self.watermarks = None
+
+    def _get_history(self, blockchain, last_block: int, end_block: int = 1):
+        return self.fetcher.history(last_block, end_block)
+
+
+def make_redis(url: str = None):
+    if url:
+        return Redis.from_url(url)
+    if fakeredis is None:
+        raise SystemExit('Install fakeredis or set --redis-url.')
+    return fakeredis.FakeStrictRedis()
+
+
+def make_mongo(uri: str = None):
+    if uri:
+        return MongoStorage(uri)
+    if mongomock is None:
+        raise SystemExit('Install mongomock or set --mongo-uri.')
+    return MongomockStorage()
+
+
+def posts_collection(mongo):
+    return getattr(mongo, APP_COLLECTIONS[Application.steepshot][CollectionType.posts])
+
+
+def seed_posts(mongo, blocks: dict) -> int:
+    """Inserts Steepshot posts which are voted in blocks, returns their number."""
+    identifiers = {
+        '@%s/%s' % (operation['op'][1]['author'], operation['op'][1]['permlink'])
+        for operations in blocks.values() for operation in operations if operation['op'][0] == 'vote'
+    }
+    if identifiers:
+        posts_collection(mongo).insert_many([
+            {'identifier': identifier, 'author': identifier[1:].split('/', 1)[0]} for identifier in identifiers
+        ])
+    return len(identifiers)
+
+
+def percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def scrape(config: Config, redis_obj, mongo, url: str, first_block: int, last_block: int,
+           window_size: int) -> dict:
+    fetcher = BlockFetcher([url], window_size=window_size, batch_size=min(5, window_size),
+                           pool=config.node_pool)
+    scraper = ReplayScraper(config, redis_obj, fetcher)
+    scraper.mongo = mongo
+    started = time.perf_counter()
+    scraper._scrape_operations(first_block, last_block)
+    return {'seconds': time.perf_counter() - started, 'blocks': redis_obj.llen(LIST_NAME)}
+
+
+def process(config: Config, redis_obj, mongo) -> dict:
+    worker = WorkerProcess(name='ReplayWorker', redis_obj=redis_obj, redis_result_obj=redis_obj,
+                           redis_list_name=LIST_NAME, config=config, reversed_mode=False,
+                           daemon=None, polling_freq=0)
+    worker.mongo = mongo
+    worker.bulk_writer = BulkWriter(mongo)
+
+    latencies = []
+    operations = 0
+    started = time.perf_counter()
+    while True:
+        block_obj = redis_obj.rpop(LIST_NAME)
+        if block_obj is None:
+            break
+        operations += len(worker.codec.decode(block_obj))
+        block_started = time.perf_counter()
+        worker._process_block(block_obj)
+        latencies.append(time.perf_counter() - block_started)
+    worker._finish()
+    return {'seconds': time.perf_counter() - started, 'blocks': len(latencies), 'operations': operations,
+            'latencies': latencies}
+
+
+def run(args) -> dict:
+    config = Config.get_instance(args.config)
+    blocks = load_blocks(args.corpus, args.blocks, args.start)
+    first_block, last_block = min(blocks), max(blocks)
+    total_operations = sum(len(operations) for operations in blocks.values())
+
+    redis_obj = make_redis(args.redis_url)
+    redis_obj.flushdb()
+    mongo = make_mongo(args.mongo_uri)
+    seeded_posts = seed_posts(mongo, blocks)
+
+    with FakeRPCServer(head_block=last_block, blocks=blocks, replies_per_post=args.replies) as server:
+        # Every RPC call, including posts fetched by worker, goes to the fake server
+        config._node_pool = NodePool([server.url])
+        scraped = scrape(config, redis_obj, mongo, server.url, first_block, last_block, args.window_size)
+        processed = process(config, redis_obj, mongo)
+
+    return {
+        'scraper_blocks_per_sec': len(blocks) / scraped['seconds'],
+        'scraper_ops_per_sec': total_operations / scraped['seconds'],
+        'queued_blocks': scraped['blocks'],
+        'worker_blocks_per_sec': processed['blocks'] / processed['seconds'] if processed['blocks'] else 0,
+        'worker_ops_per_sec': processed['operations'] / processed['seconds'] if processed['blocks'] else 0,
+        'worker_p50_ms': percentile(processed['latencies'], 50) * 1000,
+        'worker_p99_ms': percentile(processed['latencies'], 99) * 1000,
+        'seeded_posts': seeded_posts,
+        # Posts which were fetched, validated and written by worker
+        'updated_posts': posts_collection(mongo).count_documents({'body': {'$exists': True}}),
+        # Kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser('replay_benchmark')
+    parser.add_argument('-c', '--config', type=str, required=True, help='path to config file')
+    parser.add_argument('--corpus', type=str, help='recorded blocks, blocks are generated if not set')
+    parser.add_argument('--blocks', type=int, default=1000, help='number of generated blocks')
+    parser.add_argument('--start', type=int, default=1, help='first generated block')
+    parser.add_argument('--window-size', type=int, default=20)
+    parser.add_argument('--replies', type=int, default=2, help='number of replies of every post')
+    parser.add_argument('--redis-url', type=str, help='e.g. redis://127.0.0.1:6379/15, its database is flushed')
+    parser.add_argument('--mongo-uri', type=str, help='posts are inserted into its database, use an empty one')
+    parser.add_argument('--save', type=str, help='save results to JSON file')
+    parser.add_argument('--baseline', type=str, help='compare results with JSON file')
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    for name, value in results.items():
+        line = '%-24s %12.2f' % (name, value)
+        if baseline.get(name):
+            line += '  %+7.1f%%' % ((value - baseline[name]) / baseline[name] * 100)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Compares list-based operation routing with the compiled routes of config.
+
+Uses operation types of a recorded corpus (e.g. a day of blocks) or generated blocks.
+
+    python -m benchmarks.routing_benchmark --corpus day.jsonl
+"""
+import argparse
+import time
+
+import yaml
+
+from benchmarks.corpus import load_blocks
+from datascraper.config import compile_operation_routes
+
+TEMPLATE_PATH = 'conf/conf-template.yaml'
+
+
+def list_routing(operations: list, post: list, delegate: list, transfer: list, update: list, events: dict) -> int:
+    """Membership checks made by scraper and worker for every operation before routes were compiled."""
+    operation_types = post + delegate + transfer + update
+    matched = 0
+    for operation in operations:
+        op_type = operation['op'][0]
+        if op_type in operation_types:
+            if op_type in transfer or op_type in delegate or op_type in update or op_type in post:
+                matched += 1
+        if op_type in post:
+            matched += 1
+        if op_type in delegate:
+            matched += 1
+        if op_type in update:
+            matched += 1
+        if op_type in transfer:
+            matched += 1
+        if op_type in events:
+            matched += 1
+    return matched
+
+
+def compiled_routing(operations: list, routes) -> int:
+    matched = 0
+    for operation in operations:
+        route = routes.get(operation['op'][0])
+        if route is None:
+            continue
+        matched += 1
+        matched += route.post + route.delegate + route.update + route.transfer + bool(route.notification_event)
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser('routing_benchmark')
+    parser.add_argument('--corpus', type=str, default=None, help='recorded blocks, generated if not set')
+    parser.add_argument('--count', type=int, default=28800, help='number of generated blocks')
+    parser.add_argument('--config', type=str, default=TEMPLATE_PATH)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)['datascraper']
+    types = cfg['operation_types']
+    lists = (types['post_operations'], types['delegate_operations'], types['transfer_operations'],
+             types['update_operations'], cfg['notification']['events'])
+    routes = compile_operation_routes(*lists)
+
+    operations = [operation for block in load_blocks(args.corpus, args.count).values() for operation in block]
+
+    started = time.perf_counter()
+    list_routing(operations, *lists)
+    list_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled_routing(operations, routes)
+    compiled_time = time.perf_counter() - started
+
+    print('operations: %s' % len(operations))
+    print('lists:    %8.1f ns/op' % (list_time / len(operations) * 1e9))
+    print('compiled: %8.1f ns/op (x%.1f)' % (compiled_time / len(operations) * 1e9, list_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Checks that FastValidator gives the same results as Cerberus for POST_SCHEMA and compares their speed.
+
+Posts fixture is a JSON-lines file of `get_content` results, posts are generated if it's not set.
+
+    python -m benchmarks.schema_benchmark --posts posts.jsonl
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from cerberus import Validator
+
+from datascraper.fetcher import parse_time
+from datascraper.schema import POST_SCHEMA, FastValidator
+
+
+def parse_amount(value: str) -> dict:
+    amount, asset = value.split()
+    return {'amount': float(amount), 'asset': asset}
+
+
+def post_from_json(data: dict) -> dict:
+    """Converts raw `get_content` result to the form of `Post` object."""
+    post = dict(data)
+    post['identifier'] = '@%s/%s' % (post['author'], post['permlink'])
+    for field, rules in POST_SCHEMA.items():
+        value = post.get(field)
+        if rules.get('type') == 'datetime' and isinstance(value, str):
+            post[field] = parse_time(value)
+        elif rules.get('type') == 'dict' and field != 'json_metadata' and isinstance(value, str):
+            post[field] = parse_amount(value)
+    if isinstance(post.get('json_metadata'), str):
+        try:
+            post['json_metadata'] = json.loads(post['json_metadata'] or '{}')
+        except ValueError:
+            post['json_metadata'] = {}
+    post['tags'] = post['json_metadata'].get('tags', []) if isinstance(post['json_metadata'], dict) else []
+    return post
+
+
+def make_post(index: int, votes: int) -> dict:
+    created = datetime(2018, 1, 1) + timedelta(minutes=index)
+    amount = {'amount': 1.5, 'asset': 'SBD'}
+    return {
+        'identifier': '@author%s/post-%s' % (index, index), 'author': 'author%s' % index,
+        'permlink': 'post-%s' % index, 'category': 'photo', 'parent_author': '', 'parent_permlink': 'photo',
+        'title': 'Post %s' % index, 'body': '![image](https://example.com/%s.jpg)' % index,
+        'json_metadata': {'tags': ['photo', 'steepshot'], 'app': 'steepshot/0.1'},
+        'created': created, 'last_update': created, 'active': created, 'last_payout': created,
+        'cashout_time': created, 'max_cashout_time': created,
+        'depth': '0', 'children': '3', 'net_rshares': '123456789', 'abs_rshares': '123456789',
+        'vote_rshares': '123456789', 'children_abs_rshares': '0', 'total_vote_weight': '1000',
+        'reward_weight': '10000', 'author_rewards': '0', 'net_votes': str(votes), 'id': str(index),
+        'root_comment': str(index), 'percent_steem_dollars': '10000', 'body_length': '100',
+        'author_reputation': '123456789', 'score_trending': 1.0, 'score_hot': 1.0,
+        'total_payout_value': amount, 'curator_payout_value': amount, 'pending_payout_value': amount,
+        'total_pending_payout_value': amount, 'promoted': amount, 'max_accepted_payout': amount,
+        'allow_replies': True, 'allow_votes': True, 'allow_curation_rewards': True,
+        'beneficiaries': [{'account': 'steepshot', 'weight': '1000'}],
+        'replies': [], 'reblogged_by': [], 'tags': ['photo', 'steepshot'],
+        'root_title': 'Post %s' % index, 'url': '/photo/@author%s/post-%s' % (index, index),
+        'active_votes': [{'voter': 'voter%s' % vote, 'weight': str(vote), 'rshares': str(vote * 1000),
+                          'percent': '10000', 'reputation': str(vote * 10), 'time': '2018-01-01T00:00:00'}
+                         for vote in range(votes)],
+    }
+
+
+def run(validator, posts: list):
+    started = time.perf_counter()
+    results = [(validator.validate(post), validator.document) for post in posts]
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser('schema_benchmark')
+    parser.add_argument('--posts', type=str, default=None, help='recorded posts, generated if not set')
+    parser.add_argument('--count', type=int, default=200, help='number of generated posts')
+    parser.add_argument('--votes', type=int, default=300, help='number of votes of generated post')
+    args = parser.parse_args()
+
+    if args.posts:
+        with open(args.posts) as f:
+            posts = [post_from_json(json.loads(line)) for line in f]
+    else:
+        posts = [make_post(index, args.votes) for index in range(args.count)]
+
+    cerberus_results, cerberus_time = run(Validator(POST_SCHEMA, allow_unknown=True), posts)
+    fast_results, fast_time = run(FastValidator(POST_SCHEMA), posts)
+
+    # Parity on edge cases is checked by tests/test_schema.py, here it's checked on the benchmarked posts
+    for post, expected, actual in zip(posts, cerberus_results, fast_results):
+        if expected != actual:
+            raise SystemExit('Results differ for post %s' % post.get('identifier'))
+
+    print('posts: %s, valid: %s' % (len(posts), sum(valid for valid, _ in fast_results)))
+    print('cerberus: %8.1f us/post' % (cerberus_time / len(posts) * 1e6))
+    print('fast:     %8.1f us/post (x%.1f)' % (fast_time / len(posts) * 1e6, cerberus_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
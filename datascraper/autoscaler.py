@@ -0,0 +1,139 @@
+import logging
+import math
+import multiprocessing
+import time
+
+from redis import Redis
+
+from datascraper.checkpoint import requeue_claimed_blocks
+from datascraper.config import Config
+from datascraper.metrics import direction, read_metrics, series
+from datascraper.worker import WorkerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """Workers of one queue. Workers are numbered from 0, a new worker takes the lowest free number,
+    so it returns blocks claimed by a stopped worker with the same name back to the queue."""
+
+    def __init__(self, config: Config, redis_obj: Redis, list_name: str, reversed_mode: bool, polling_freq: float):
+        self.config = config
+        self.redis_obj = redis_obj
+        self.list_name = list_name
+        self.reversed_mode = reversed_mode
+        self.polling_freq = polling_freq
+        options = config.autoscaling.workers[list_name]
+        self.min_workers = options.min_workers
+        self.max_workers = options.max_workers
+        self.workers = {}
+        self.retiring = {}
+
+    def __len__(self):
+        return len(self.workers)
+
+    def _name(self, number: int) -> str:
+        return 'Worker-{}-{}'.format(number, 'Backward' if self.reversed_mode else 'Forward')
+
+    def spawn(self) -> WorkerProcess:
+        # Number of a retiring worker isn't reused until it exits, they would share the processing list
+        number = next(number for number in range(len(self.workers) + len(self.retiring) + 1)
+                      if number not in self.workers and number not in self.retiring)
+        # Worker creates its own Redis clients after it is started
+        worker = WorkerProcess(name=self._name(number), redis_obj=None,
+                               redis_result_obj=None, redis_list_name=self.list_name,
+                               config=self.config, reversed_mode=self.reversed_mode, daemon=False,
+                               polling_freq=self.polling_freq, stop_event=multiprocessing.Event())
+        worker.start()
+        self.workers[number] = worker
+        return worker
+
+    def retire(self) -> WorkerProcess:
+        """Asks the worker with the greatest number to write processed blocks and exit."""
+        number = max(self.workers)
+        worker = self.workers.pop(number)
+        worker.stop_event.set()
+        self.retiring[number] = worker
+        return worker
+
+    def reap(self):
+        """Forgets workers which have exited, blocks claimed by crashed workers are returned to the queue."""
+        self.retiring = {number: worker for number, worker in self.retiring.items() if worker.is_alive()}
+        for number, worker in list(self.workers.items()):
+            if not worker.is_alive():
+                requeued = requeue_claimed_blocks(self.redis_obj, worker.processing_list_name, self.list_name)
+                logger.error('%s has exited with code %s, %s claimed blocks are returned to "%s".',
+                             worker.name, worker.exitcode, requeued, self.list_name)
+                del self.workers[number]
+
+    def stop_all(self, timeout: float = None):
+        """Asks all workers to write processed blocks and exit, terminates them after `timeout`."""
+        while self.workers:
+            self.retire()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for worker in self.retiring.values():
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logger.warning('%s is not stopped in time, kill it.', worker.name)
+                worker.kill()
+                worker.join()
+        self.retiring.clear()
+
+    def processed_blocks(self) -> float:
+        """Number of blocks processed by workers of this queue, as reported to metrics."""
+        key = series('datascraper_blocks_total', direction=direction(self.reversed_mode), stage='processed')
+        return read_metrics([self.redis_obj]).get(key, 0)
+
+
+class WorkerAutoscaler(object):
+    """Keeps the number of workers of every queue between its bounds, so that the queue is expected
+    to be drained within `drain_time` at the throughput per worker measured since the last check.
+
+    Workers are added at once and removed one per check to avoid flapping.
+    """
+
+    def __init__(self, pools: list, interval: float = 15, drain_time: float = 60):
+        self.pools = pools
+        self.interval = interval
+        self.drain_time = drain_time
+        self._last = {}
+
+    def _throughput(self, pool: WorkerPool) -> float:
+        """Returns blocks per second processed by one worker since the previous check."""
+        now, processed = time.monotonic(), pool.processed_blocks()
+        last = self._last.get(pool.list_name)
+        self._last[pool.list_name] = (now, processed, len(pool))
+        if not last or not last[2] or now <= last[0]:
+            return 0
+        return max(0, processed - last[1]) / (now - last[0]) / last[2]
+
+    def desired_workers(self, pool: WorkerPool, length: int, throughput: float) -> int:
+        if not length:
+            target = pool.min_workers
+        elif throughput:
+            target = math.ceil(length / (throughput * self.drain_time))
+        else:
+            # Throughput isn't known yet
+            target = len(pool)
+        return min(pool.max_workers, max(pool.min_workers, target))
+
+    def scale(self, pool: WorkerPool):
+        pool.reap()
+        length = pool.redis_obj.llen(pool.list_name)
+        throughput = self._throughput(pool)
+        target = self.desired_workers(pool, length, throughput)
+
+        if target > len(pool):
+            logger.info('Queue "%s" has %s blocks at %.1f blocks/s per worker, workers: %s -> %s.',
+                        pool.list_name, length, throughput, len(pool), target)
+            while len(pool) < target:
+                pool.spawn()
+        elif target < len(pool):
+            worker = pool.retire()
+            logger.info('Queue "%s" has %s blocks at %.1f blocks/s per worker, %s is retired.',
+                        pool.list_name, length, throughput, worker.name)
+
+    def step(self):
+        """Scales every pool once, is called by supervisor every `interval` seconds."""
+        for pool in self.pools:
+            self.scale(pool)
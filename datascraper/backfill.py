@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+from typing import Optional
+
+from steepcommon.mongo.storage import MongoStorage
+
+from datascraper.checkpoint import CheckpointTracker
+
+logger = logging.getLogger(__name__)
+
+RANGES_FIELD = 'backfill_ranges'
+# Set when scraper has dispatched all blocks of the range, they may still be processed by workers
+SCRAPED_FIELD = 'scraped'
+
+
+class BackfillRanges(object):
+    """Persists block ranges of backward scraping in the settings document.
+
+    Every range is scraped from `start` down to `end`, `position` is the next block
+    which should be processed. Range is finished when workers have written all its blocks.
+    """
+
+    def __init__(self, mongo: MongoStorage):
+        self._settings = mongo.Settings
+
+    def all(self) -> dict:
+        document = self._settings.find_one() or {}
+        return document.get(RANGES_FIELD, {})
+
+    def get(self, range_id: str) -> dict:
+        return self.all().get(range_id)
+
+    def create(self, last_block: int, range_size: int) -> dict:
+        ranges = {}
+        start = last_block
+        while start >= 1:
+            end = max(1, start - range_size + 1)
+            ranges[str(start)] = {'start': start, 'end': end, 'position': start}
+            start = end - 1
+        self._settings.update_one({}, {'$set': {RANGES_FIELD: ranges}}, upsert=True)
+        return ranges
+
+    def update_position(self, range_id: str, position: int):
+        self._settings.update_one({}, {'$set': {'%s.%s.position' % (RANGES_FIELD, range_id): position}}, upsert=True)
+
+    def set_scraped(self, range_id: str):
+        self._settings.update_one({}, {'$set': {'%s.%s.%s' % (RANGES_FIELD, range_id, SCRAPED_FIELD): True}},
+                                  upsert=True)
+
+    def reset_scraped(self, range_ids: list):
+        if range_ids:
+            self._settings.update_one({}, {'$set': {'%s.%s.%s' % (RANGES_FIELD, range_id, SCRAPED_FIELD): False
+                                                    for range_id in range_ids}}, upsert=True)
+
+    def finish(self, range_id: str, end: int):
+        self._settings.update_one({}, {'$set': {'%s.%s.finished' % (RANGES_FIELD, range_id): True,
+                                                '%s.%s.position' % (RANGES_FIELD, range_id): end - 1}}, upsert=True)
+
+    @staticmethod
+    def is_finished(block_range: dict) -> bool:
+        return block_range.get('finished', False) or block_range['position'] < block_range['end']
+
+
+class BackfillCoordinator(object):
+    """Splits backward scraping into ranges and hands them out to scrapers.
+
+    Ranges are much smaller than the whole history, so scrapers which finish earlier
+    take the remaining ranges and the load is rebalanced between processes.
+    """
+
+    def __init__(self, mongo: MongoStorage, range_size: int):
+        self.ranges = BackfillRanges(mongo)
+        self.range_size = range_size
+        self.queue = multiprocessing.Queue()
+
+    def prepare(self, last_reversed_block: int) -> int:
+        """Fills queue with unfinished ranges, starting from the newest blocks. Returns number of ranges."""
+        ranges = self.ranges.all()
+        if not ranges:
+            logger.info('Split backward scraping from block %s into ranges of %s blocks.',
+                        last_reversed_block, self.range_size)
+            ranges = self.ranges.create(last_reversed_block, self.range_size)
+
+        unfinished = [range_id for range_id, block_range in ranges.items()
+                      if not BackfillRanges.is_finished(block_range)]
+        # Queues are flushed on start, so blocks of unfinished ranges are scraped again from their positions
+        self.ranges.reset_scraped(unfinished)
+        for range_id in sorted(unfinished, key=int, reverse=True):
+            self.queue.put(range_id)
+        logger.info('%s of %s backward ranges are left to scrape.', len(unfinished), len(ranges))
+        return len(unfinished)
+
+
+class RangeCheckpoints(object):
+    """Moves positions of ranges to checkpoints of their completed blocks and finishes ranges."""
+
+    def __init__(self, mongo: MongoStorage):
+        self.ranges = BackfillRanges(mongo)
+        self._ranges = {}
+        self.reload()
+
+    def reload(self):
+        self._ranges = self.ranges.all()
+
+    def update(self, tracker: CheckpointTracker):
+        """Moves positions of unfinished ranges which have completed blocks to their contiguous checkpoints.
+        Range is finished when scraper has dispatched all its blocks and none of them is pending."""
+        # Ranges are read before pending blocks, so blocks of a scraped range are all dispatched by then
+        self.reload()
+        unfinished = [(range_id, block_range) for range_id, block_range in self._ranges.items()
+                      if not BackfillRanges.is_finished(block_range)]
+        has_completed = tracker.has_completed([(block_range['end'], block_range['start'])
+                                               for _, block_range in unfinished])
+
+        for (range_id, block_range), completed in zip(unfinished, has_completed):
+            low, high = block_range['end'], block_range['start']
+            if completed:
+                checkpoint = tracker.checkpoint(low=low, high=high)
+                if checkpoint is not None:
+                    if checkpoint - 1 < block_range['position']:
+                        block_range['position'] = checkpoint - 1
+                        self.ranges.update_position(range_id, block_range['position'])
+                    tracker.trim(checkpoint, low=low, high=high)
+            if block_range.get(SCRAPED_FIELD) and not tracker.has_pending(low, high):
+                block_range['position'] = low - 1
+                block_range['finished'] = True
+                self.ranges.finish(range_id, low)
+                # Checkpoint below the range removes all its completed blocks
+                tracker.trim(low - 1, low=low, high=high)
+                logger.info('Backward range %s-%s is finished.', high, low)
+
+    def last_block(self) -> Optional[int]:
+        """Returns the last block of the contiguous synced part of backward scraping, ranges are synced
+        from the newest one, or None if there are no ranges."""
+        if not self._ranges:
+            return None
+        for block_range in sorted(self._ranges.values(), key=lambda block_range: block_range['start'], reverse=True):
+            if not BackfillRanges.is_finished(block_range):
+                return block_range['position'] + 1
+        return min(block_range['end'] for block_range in self._ranges.values())
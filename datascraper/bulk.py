@@ -0,0 +1,57 @@
+import logging
+from collections import OrderedDict
+
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from steepcommon.mongo.storage import MongoStorage
+from steepcommon.utils import retry
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+class BulkWriter(object):
+    """Collects write requests per collection and sends them with unordered `bulk_write` calls.
+
+    Every request is stored together with a short description, so each failed write
+    is reported separately. Duplicate key errors are ignored the same way as they
+    were ignored for single `insert_one`/`update_one` calls.
+    """
+
+    def __init__(self, mongo: MongoStorage):
+        self.mongo = mongo
+        self._requests = OrderedDict()
+
+    def __len__(self):
+        return sum(len(requests) for requests in self._requests.values())
+
+    def add(self, collection_name: str, request, description: str):
+        self._requests.setdefault(collection_name, []).append((request, description))
+
+    def clear(self):
+        self._requests.clear()
+
+    def _bulk_write(self, collection_name: str, requests: list):
+        collection = getattr(self.mongo, collection_name)
+        try:
+            return collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as error:
+            return error
+
+    def flush(self) -> int:
+        """Sends all collected requests to database. Returns number of failed writes."""
+        failed = 0
+        for collection_name, items in self._requests.items():
+            requests = [request for request, _ in items]
+            result = retry(self._bulk_write, 5, ConnectionFailure)(collection_name, requests)
+            if isinstance(result, ConnectionFailure):
+                logger.error('Failed to write %s requests to "%s": %s', len(requests), collection_name, result)
+                failed += len(requests)
+            elif isinstance(result, BulkWriteError):
+                for write_error in result.details.get('writeErrors', []):
+                    if write_error.get('code') == DUPLICATE_KEY_ERROR_CODE:
+                        continue
+                    failed += 1
+                    logger.error('Failed to %s. Error: %s', items[write_error['index']][1], write_error.get('errmsg'))
+        self.clear()
+        return failed
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from steepcommon.enums import CollectionType
+
+
+class LRUCache(object):
+    """Bounded LRU cache with time-to-live for every entry. Counts hits and misses."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and item[1] > time.monotonic()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class OwnershipCache(LRUCache):
+    """Caches which apps own a post identifier, separately for posts and comments collections.
+
+    An empty set is a valid value and means that identifier doesn't belong to any app. It is kept only
+    for `negative_ttl` seconds, because the post may be just about to be written by another worker.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60, negative_ttl: float = None):
+        super(OwnershipCache, self).__init__(max_size, ttl)
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+
+    def get_apps(self, collection_type, identifier: str):
+        return self.get((collection_type, identifier))
+
+    def set_apps(self, collection_type, identifier: str, apps):
+        apps = frozenset(apps)
+        self.set((collection_type, identifier), apps, ttl=None if apps else self.negative_ttl)
+
+    def add_apps(self, collection_type, identifier: str, apps):
+        """Marks apps as owners of identifier, e.g. when the post is just about to be written by worker."""
+        key = (collection_type, identifier)
+        known = self._data.get(key)
+        self.set(key, frozenset(apps).union(known[0] if known else ()))
+
+    def invalidate(self, identifier: str):
+        for collection_type in CollectionType:
+            self._data.pop((collection_type, identifier), None)
+
+
+PostInfo = namedtuple('PostInfo', ['is_comment', 'root_identifier'])
+
+
+class PostIndex(LRUCache):
+    """Maps post identifier to PostInfo, so notifications can be built without fetching posts.
+
+    It is shared by worker and notification dispatcher threads, so every access is locked.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        super(PostIndex, self).__init__(max_size, ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return super(PostIndex, self).get(key, default)
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            super(PostIndex, self).set(key, value, ttl)
+
+    def add_post(self, identifier: str, post: dict):
+        """Saves post info from a post object or a document of posts or comments collection."""
+        if post.get('root_author') and post.get('root_permlink'):
+            root_identifier = '@%s/%s' % (post['root_author'], post['root_permlink'])
+        elif not post.get('parent_author'):
+            root_identifier = identifier
+        else:
+            return
+        self.set(identifier, PostInfo(root_identifier != identifier, root_identifier))
+
+    def add_operation(self, operation: dict):
+        """Saves post info from a comment operation, a reply is saved only if its parent is known."""
+        identifier = '@%s/%s' % (operation['author'], operation['permlink'])
+        if not operation.get('parent_author'):
+            self.set(identifier, PostInfo(False, identifier))
+            return
+        parent = self.get('@%s/%s' % (operation['parent_author'], operation['parent_permlink']))
+        if parent is not None:
+            self.set(identifier, PostInfo(True, parent.root_identifier))
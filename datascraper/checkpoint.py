@@ -0,0 +1,159 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from redis import Redis
+
+logger = logging.getLogger(__name__)
+
+
+def pending_key(list_name: str) -> str:
+    return '{list}:pending'.format(list=list_name)
+
+
+def dispatch_block(redis_obj: Redis, list_name: str, block_num: int, data: bytes) -> int:
+    """Puts block into the queue and marks it as pending in one transaction. Returns length of the queue."""
+    pipe = redis_obj.pipeline()
+    pipe.zadd(pending_key(list_name), {block_num: block_num})
+    pipe.lpush(list_name, data)
+    return pipe.execute()[-1]
+
+
+def dead_letter_key(list_name: str) -> str:
+    return '{list}:dead'.format(list=list_name)
+
+
+def dead_letter_block(redis_obj: Redis, list_name: str, data: bytes, block_num: Optional[int] = None,
+                      processing_list_name: str = None):
+    """Moves block which can't be decoded to the dead-letter list of the queue. If its number is known,
+    it's removed from pending too, so checkpoint isn't held back by a block which will never be completed."""
+    pipe = redis_obj.pipeline()
+    pipe.lpush(dead_letter_key(list_name), data)
+    if block_num is not None:
+        pipe.zrem(pending_key(list_name), block_num)
+    if processing_list_name:
+        pipe.lrem(processing_list_name, 1, data)
+    pipe.execute()
+
+
+def complete_blocks(redis_obj: Redis, redis_result_obj: Redis, list_name: str, block_nums: list,
+                    processing_list_name: str = None, block_objs: list = ()):
+    """Marks blocks as completed in two round trips for any number of blocks. They are added to results
+    before they are removed from pending, so checkpoint never passes a block which is in neither of these sets.
+    Claimed `block_objs` are removed from `processing_list_name` in the same transaction as pending blocks."""
+    if not block_nums:
+        return
+    redis_result_obj.zadd(list_name, {block_num: block_num for block_num in block_nums})
+    pipe = redis_obj.pipeline()
+    pipe.zrem(pending_key(list_name), *block_nums)
+    for block_obj in block_objs:
+        pipe.lrem(processing_list_name, 1, block_obj)
+    pipe.execute()
+
+
+def requeue_claimed_blocks(redis_obj: Redis, processing_list_name: str, list_name: str) -> int:
+    """Returns blocks claimed by a worker back to the queue. Returns number of blocks."""
+    number = 0
+    while redis_obj.rpoplpush(processing_list_name, list_name) is not None:
+        number += 1
+    return number
+
+
+class CheckpointTracker(object):
+    """Finds the last block of the contiguous completed prefix of a queue.
+
+    Scraper adds every dispatched block to the pending sorted set of the queue, workers move
+    completed blocks to the sorted set with the queue name in result database. In forward mode
+    checkpoint is the greatest completed block below the lowest pending one, in reversed mode -
+    the least completed block above the greatest pending one. Every lookup is O(log n).
+    """
+
+    def __init__(self, redis_obj: Redis, redis_result_obj: Redis, list_name: str, reversed_mode: bool):
+        self.redis_obj = redis_obj
+        self.redis_result_obj = redis_result_obj
+        self.list_name = list_name
+        self.reversed_mode = reversed_mode
+
+    def checkpoint(self, low: int = None, high: int = None) -> Optional[int]:
+        """Returns checkpoint among blocks from `low` to `high` or None if there are no completed blocks.
+
+        Completed blocks are read before pending ones. Workers add blocks to results before they remove
+        them from pending, and blocks are dispatched in order, so every block before a block completed at
+        the first read is either still pending at the second read or completed. Reading pending blocks
+        first could miss blocks dispatched and completed in between.
+        """
+        low = '-inf' if low is None else low
+        high = '+inf' if high is None else high
+        pending = pending_key(self.list_name)
+
+        if self.reversed_mode:
+            completed = self.redis_result_obj.zrangebyscore(self.list_name, low, high, start=0, num=1)
+            if not completed:
+                return None
+            first_pending = self.redis_obj.zrevrangebyscore(pending, high, low, start=0, num=1)
+            if first_pending and int(first_pending[0]) >= int(completed[0]):
+                completed = self.redis_result_obj.zrangebyscore(self.list_name, '(%d' % int(first_pending[0]),
+                                                                high, start=0, num=1)
+        else:
+            completed = self.redis_result_obj.zrevrangebyscore(self.list_name, high, low, start=0, num=1)
+            if not completed:
+                return None
+            first_pending = self.redis_obj.zrangebyscore(pending, low, high, start=0, num=1)
+            if first_pending and int(first_pending[0]) <= int(completed[0]):
+                completed = self.redis_result_obj.zrevrangebyscore(self.list_name, '(%d' % int(first_pending[0]),
+                                                                   low, start=0, num=1)
+
+        return int(completed[0]) if completed else None
+
+    def has_completed(self, ranges: list) -> list:
+        """Returns whether every one of (low, high) ranges has completed blocks, in one round trip."""
+        pipe = self.redis_result_obj.pipeline(transaction=False)
+        for low, high in ranges:
+            pipe.zrangebyscore(self.list_name, low, high, start=0, num=1)
+        return [bool(completed) for completed in pipe.execute()]
+
+    def has_pending(self, low: int, high: int) -> bool:
+        return bool(self.redis_obj.zrangebyscore(pending_key(self.list_name), low, high, start=0, num=1))
+
+    def trim(self, checkpoint: int, low: int = None, high: int = None):
+        """Removes completed blocks which are behind the checkpoint, the checkpoint itself is kept."""
+        if self.reversed_mode:
+            self.redis_result_obj.zremrangebyscore(self.list_name, '(%d' % checkpoint, '+inf' if high is None else high)
+        else:
+            self.redis_result_obj.zremrangebyscore(self.list_name, '-inf' if low is None else low, '(%d' % checkpoint)
+
+
+class BlockSequence(object):
+    """Finds the checkpoint of blocks which are dispatched in order and completed in any order, in memory.
+
+    It's the counterpart of `CheckpointTracker` for asyncio pipeline, where all stages run in one process:
+    checkpoint is the block before the first pending one or the last dispatched block if none are pending.
+    """
+
+    def __init__(self, last_block: int, reversed_mode: bool):
+        self.last_block = last_block
+        self.reversed_mode = reversed_mode
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dispatch(self, block_num: int):
+        with self._lock:
+            self._pending[block_num] = True
+            self.last_block = block_num
+
+    def skip(self, block_num: int):
+        """Marks block which has nothing to process as passed."""
+        with self._lock:
+            self.last_block = block_num
+
+    def complete(self, block_num: int):
+        with self._lock:
+            self._pending.pop(block_num, None)
+
+    def checkpoint(self) -> int:
+        with self._lock:
+            if not self._pending:
+                return self.last_block
+            first_pending = next(iter(self._pending))
+            return first_pending + 1 if self.reversed_mode else first_pending - 1
@@ -0,0 +1,143 @@
+import pickle
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# The first byte of every encoded block is the version of its format.
+# Pickle data always starts with PROTO opcode, so blocks from old scrapers are recognized too.
+PICKLE = 0x80
+MSGPACK = 0x01
+MSGPACK_ZLIB = 0x02
+MSGPACK_ZSTD = 0x03
+MSGPACK_LZ4 = 0x04
+# Set in the version of blocks which have their number in the header, it's readable even if the payload is corrupt
+BLOCK_NUM_FLAG = 0x10
+BLOCK_NUM_HEADER = struct.Struct('>I')
+
+COMPRESSIONS = {
+    None: MSGPACK,
+    'zlib': MSGPACK_ZLIB,
+    'zstd': MSGPACK_ZSTD,
+    'lz4': MSGPACK_LZ4,
+}
+
+DATETIME_EXT_TYPE = 1
+EPOCH = datetime(1970, 1, 1)
+
+
+class CodecError(Exception):
+    pass
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(DATETIME_EXT_TYPE, struct.pack('>q', int((obj - EPOCH).total_seconds() * 1000000)))
+    raise TypeError('Unknown type: %r' % obj)
+
+
+def _ext_hook(code, data):
+    if code == DATETIME_EXT_TYPE:
+        return EPOCH + timedelta(microseconds=struct.unpack('>q', data)[0])
+    return msgpack.ExtType(code, data)
+
+
+class QueueCodec(object):
+    """Encodes blocks for Redis queues.
+
+    Blocks are encoded with the configured serializer and compression, but any known format can be decoded,
+    so scrapers and workers of different versions may work with the same queue.
+    Pickle is decoded only if `accept_pickle` is set, because it may execute arbitrary code.
+    Msgpack blocks are written with the block number in the header, workers should be updated
+    before scrapers, because older workers don't know this header.
+    """
+
+    def __init__(self, serializer: str = 'msgpack', compression: str = None, accept_pickle: bool = False):
+        if serializer not in ('msgpack', 'pickle'):
+            raise CodecError('Unknown serializer "%s".' % serializer)
+        if compression not in COMPRESSIONS:
+            raise CodecError('Unknown compression "%s".' % compression)
+        if serializer == 'msgpack' and msgpack is None:
+            raise CodecError('Serializer "msgpack" requires "msgpack" package.')
+        if compression == 'zstd' and zstandard is None:
+            raise CodecError('Compression "zstd" requires "zstandard" package.')
+        if compression == 'lz4' and lz4 is None:
+            raise CodecError('Compression "lz4" requires "lz4" package.')
+
+        self.version = PICKLE if serializer == 'pickle' else COMPRESSIONS[compression]
+        self.accept_pickle = accept_pickle or serializer == 'pickle'
+        self._zstd_compressor = zstandard.ZstdCompressor() if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def encode(self, block: list) -> bytes:
+        if self.version == PICKLE:
+            return pickle.dumps(block)
+
+        data = msgpack.packb(block, default=_default, use_bin_type=True)
+        if self.version == MSGPACK_ZLIB:
+            data = zlib.compress(data)
+        elif self.version == MSGPACK_ZSTD:
+            data = self._zstd_compressor.compress(data)
+        elif self.version == MSGPACK_LZ4:
+            data = lz4.frame.compress(data)
+        return bytes((self.version | BLOCK_NUM_FLAG,)) + BLOCK_NUM_HEADER.pack(int(block[0]['block_num'])) + data
+
+    @staticmethod
+    def block_num(data: bytes):
+        """Returns number of encoded block from its header or None if the format has no header."""
+        if len(data) < 1 + BLOCK_NUM_HEADER.size or data[0] == PICKLE or not data[0] & BLOCK_NUM_FLAG:
+            return None
+        return BLOCK_NUM_HEADER.unpack_from(data, 1)[0]
+
+    def decode(self, data: bytes) -> list:
+        """Decodes block, any error of decompression or deserialization is raised as CodecError."""
+        if not data:
+            raise CodecError('Empty block data.')
+        try:
+            block = self._decode(data)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError('Failed to decode block: %r' % e) from e
+        if not isinstance(block, list) or not block:
+            raise CodecError('Block has no operations.')
+        return block
+
+    def _decode(self, data: bytes) -> list:
+        version, payload = data[0], data[1:]
+        if version != PICKLE and version & BLOCK_NUM_FLAG:
+            version, payload = version & ~BLOCK_NUM_FLAG, payload[BLOCK_NUM_HEADER.size:]
+        if version == PICKLE:
+            if not self.accept_pickle:
+                raise CodecError('Pickled blocks are not accepted.')
+            return pickle.loads(data)
+
+        if msgpack is None:
+            raise CodecError('Serializer "msgpack" requires "msgpack" package.')
+        if version == MSGPACK_ZLIB:
+            payload = zlib.decompress(payload)
+        elif version == MSGPACK_ZSTD:
+            if zstandard is None:
+                raise CodecError('Compression "zstd" requires "zstandard" package.')
+            payload = self._zstd_decompressor.decompress(payload)
+        elif version == MSGPACK_LZ4:
+            if lz4 is None:
+                raise CodecError('Compression "lz4" requires "lz4" package.')
+            payload = lz4.frame.decompress(payload)
+        elif version != MSGPACK:
+            raise CodecError('Unknown block format version: %s.' % version)
+        return msgpack.unpackb(payload, ext_hook=_ext_hook, raw=False)
@@ -1,8 +1,13 @@
 import os
+from collections import namedtuple
+from types import MappingProxyType
 
 import yaml
 from steepcommon.conf import IS_STEEM_PARAM_NAME, IS_GOLOS_PARAM_NAME
 
+from datascraper.codec import CodecError, QueueCodec
+from datascraper.nodes import NodePool
+
 
 class empty: pass  # used in cases where None value is valid
 
@@ -48,6 +53,24 @@ def get_or_raise(obj: dict, *keys, pop=False, default=empty):
     return value
 
 
+# What should be done with an operation of a certain type, compiled once from `operation_types` section
+OperationRoute = namedtuple('OperationRoute', ['post', 'delegate', 'transfer', 'update', 'notification_event'])
+
+
+def compile_operation_routes(post_operations: list, delegate_operations: list, transfer_operations: list,
+                             update_operations: list, notification_events: dict) -> MappingProxyType:
+    routes = {}
+    for op_type in set(post_operations + delegate_operations + transfer_operations + update_operations):
+        routes[op_type] = OperationRoute(
+            post=op_type in post_operations,
+            delegate=op_type in delegate_operations,
+            transfer=op_type in transfer_operations,
+            update=op_type in update_operations,
+            notification_event=notification_events.get(op_type),
+        )
+    return MappingProxyType(routes)
+
+
 class Config(object):
     __instance = None
 
@@ -61,10 +84,32 @@ class Config(object):
         self._transfer_operations = []
         self._curators_payouts = []
         self._update_operations = []
+        self._operation_routes = MappingProxyType({})
         self._log_path = None
         self._max_attempts = None
         self._skip_freq = None
         self._notification = None
+        self._bulk_write_blocks = None
+        self._ownership_cache = None
+        self._blocking_queue = None
+        self._backfill = None
+        self._fetcher = None
+        self._node_pool = None
+        self._runtime = None
+        self._backpressure = {}
+        self._checkpoint_interval = None
+        self._ack_interval = None
+        self._metrics = None
+        self._autoscaling = None
+        self._supervisor = None
+        self._prefilter = None
+        self._identifier_index = None
+        self._indexes = None
+        self._connections = None
+        self._queue_codec = None
+        self._post_updates = None
+        self._post_validator = None
+        self._asyncio = None
 
         self._cfg = None
         self._load_conf(config_path)
@@ -98,6 +143,10 @@ class Config(object):
     def update_operations(self):
         return self._update_operations
 
+    @property
+    def operation_routes(self):
+        return self._operation_routes
+
     @property
     def log_path(self):
         return self._log_path
@@ -122,6 +171,90 @@ class Config(object):
     def notification(self):
         return self._notification
 
+    @property
+    def bulk_write_blocks(self):
+        return self._bulk_write_blocks
+
+    @property
+    def post_validator(self):
+        return self._post_validator
+
+    @property
+    def post_updates(self):
+        return self._post_updates
+
+    @property
+    def queue_codec(self):
+        return self._queue_codec
+
+    @property
+    def checkpoint_interval(self):
+        return self._checkpoint_interval
+
+    @property
+    def ack_interval(self):
+        return self._ack_interval
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def autoscaling(self):
+        return self._autoscaling
+
+    @property
+    def supervisor(self):
+        return self._supervisor
+
+    @property
+    def prefilter(self):
+        return self._prefilter
+
+    @property
+    def identifier_index(self):
+        return self._identifier_index
+
+    @property
+    def indexes(self):
+        return self._indexes
+
+    @property
+    def connections(self):
+        return self._connections
+
+    @property
+    def backpressure(self):
+        return self._backpressure
+
+    @property
+    def runtime(self):
+        return self._runtime
+
+    @property
+    def asyncio(self):
+        return self._asyncio
+
+    @property
+    def fetcher(self):
+        return self._fetcher
+
+    @property
+    def node_pool(self):
+        return self._node_pool
+
+    @property
+    def backfill(self):
+        return self._backfill
+
+    @property
+    def blocking_queue(self):
+        return self._blocking_queue
+
+    @property
+    def ownership_cache(self):
+        return self._ownership_cache
+
     @property
     def redis_host(self):
         return self._redis.host
@@ -188,12 +321,149 @@ class Config(object):
 
         self._max_attempts = get_or_raise(self._cfg, 'datascraper', 'max_attempts', pop=True, default=50)
         self._skip_freq = get_or_raise(self._cfg, 'datascraper', 'skip_freq', pop=True, default=5)
+        self._blocking_queue = get_or_raise(self._cfg, 'datascraper', 'blocking_queue', pop=True, default=True)
+        self._bulk_write_blocks = get_or_raise(self._cfg, 'datascraper', 'bulk_write_blocks', pop=True, default=1)
         self._notification = Object(
             url=get_or_raise(self._cfg, 'datascraper', 'notification', 'url'),
             token=get_or_raise(self._cfg, 'datascraper', 'notification', 'token',
                                default='f3e95ecbaf6f0a86acabcd43cda913c8afcd7e77'),
             events=get_or_raise(self._cfg, 'datascraper', 'notification', 'events'),
             send=get_or_raise(self._cfg, 'datascraper', 'notification', 'send', default=False),
+            timeout=get_or_raise(self._cfg, 'datascraper', 'notification', 'timeout', default=5),
+            queue_size=get_or_raise(self._cfg, 'datascraper', 'notification', 'queue_size', default=1000),
+            batch_size=get_or_raise(self._cfg, 'datascraper', 'notification', 'batch_size', default=1),
+            batch_interval=get_or_raise(self._cfg, 'datascraper', 'notification', 'batch_interval', default=1),
+            max_attempts=get_or_raise(self._cfg, 'datascraper', 'notification', 'max_attempts', default=3),
+            backoff=get_or_raise(self._cfg, 'datascraper', 'notification', 'backoff', default=0.5),
+            drain_timeout=get_or_raise(self._cfg, 'datascraper', 'notification', 'drain_timeout', default=30),
+            index_size=get_or_raise(self._cfg, 'datascraper', 'notification', 'index_size', default=100000),
+            index_ttl=get_or_raise(self._cfg, 'datascraper', 'notification', 'index_ttl', default=86400),
+        )
+
+        self._ownership_cache = Object(
+            max_size=get_or_raise(self._cfg, 'datascraper', 'ownership_cache', 'max_size', default=100000),
+            ttl=get_or_raise(self._cfg, 'datascraper', 'ownership_cache', 'ttl', default=60),
+            negative_ttl=get_or_raise(self._cfg, 'datascraper', 'ownership_cache', 'negative_ttl', default=2),
+        )
+
+        self._post_validator = get_or_raise(self._cfg, 'datascraper', 'post_validator', pop=True,
+                                            default='cerberus').lower()
+        if self._post_validator not in ['cerberus', 'fast']:
+            raise ConfigError('Failed to parse post_validator: may be only "cerberus" or "fast".')
+
+        self._post_updates = Object(
+            coalesce_window=get_or_raise(self._cfg, 'datascraper', 'post_updates', 'coalesce_window', default=10),
+            cache_size=get_or_raise(self._cfg, 'datascraper', 'post_updates', 'cache_size', default=1000),
+            cache_ttl=get_or_raise(self._cfg, 'datascraper', 'post_updates', 'cache_ttl', default=3),
+            incremental_replies=get_or_raise(self._cfg, 'datascraper', 'post_updates', 'incremental_replies',
+                                             default=True),
+            reconcile_interval=get_or_raise(self._cfg, 'datascraper', 'post_updates', 'reconcile_interval',
+                                            default=86400),
+        )
+
+        self._queue_codec = Object(
+            serializer=get_or_raise(self._cfg, 'datascraper', 'queue_codec', 'serializer', default='msgpack'),
+            compression=get_or_raise(self._cfg, 'datascraper', 'queue_codec', 'compression', default=None),
+            accept_pickle=get_or_raise(self._cfg, 'datascraper', 'queue_codec', 'accept_pickle', default=False),
+        )
+        try:
+            QueueCodec(self._queue_codec.serializer, self._queue_codec.compression, self._queue_codec.accept_pickle)
+        except CodecError as e:
+            raise ConfigError('Failed to parse queue_codec: %s' % e)
+
+        self._checkpoint_interval = get_or_raise(self._cfg, 'datascraper', 'checkpoint_interval', pop=True, default=1)
+        self._ack_interval = get_or_raise(self._cfg, 'datascraper', 'ack_interval', pop=True, default=1)
+        self._metrics = Object(
+            host=get_or_raise(self._cfg, 'datascraper', 'metrics', 'host', default='127.0.0.1'),
+            port=get_or_raise(self._cfg, 'datascraper', 'metrics', 'port', default=0),
+            flush_interval=get_or_raise(self._cfg, 'datascraper', 'metrics', 'flush_interval', default=10),
+        )
+
+        default_workers = min(4, os.cpu_count())
+        workers = {}
+        for list_name in ('forward_db', 'backward_db'):
+            options = get_or_raise(self._cfg, 'datascraper', 'autoscaling', list_name, default=None) or {}
+            workers[list_name] = Object(
+                min_workers=options.get('min_workers', default_workers),
+                max_workers=options.get('max_workers', default_workers),
+            )
+            if not 1 <= workers[list_name].min_workers <= workers[list_name].max_workers:
+                raise ConfigError('Failed to parse autoscaling for "%s": 1 <= min_workers <= max_workers is required.'
+                                  % list_name)
+        self._autoscaling = Object(
+            workers=workers,
+            interval=get_or_raise(self._cfg, 'datascraper', 'autoscaling', 'interval', default=15),
+            drain_time=get_or_raise(self._cfg, 'datascraper', 'autoscaling', 'drain_time', default=60),
+        )
+
+        self._supervisor = Object(
+            backoff=get_or_raise(self._cfg, 'datascraper', 'supervisor', 'backoff', default=1),
+            max_backoff=get_or_raise(self._cfg, 'datascraper', 'supervisor', 'max_backoff', default=60),
+            shutdown_timeout=get_or_raise(self._cfg, 'datascraper', 'supervisor', 'shutdown_timeout', default=300),
+        )
+
+        watermarks = get_or_raise(self._cfg, 'datascraper', 'backpressure', pop=True, default={})
+        for list_name, options in watermarks.items():
+            high = get_or_raise(options, 'high')
+            low = get_or_raise(options, 'low', default=high // 2)
+            if low >= high:
+                raise ConfigError('Failed to parse backpressure for "%s": low watermark must be less than high.'
+                                  % list_name)
+            self._backpressure[list_name] = Object(
+                high=high, low=low, polling_freq=get_or_raise(options, 'polling_freq', default=1)
+            )
+
+        self._runtime = get_or_raise(self._cfg, 'datascraper', 'runtime', pop=True, default='processes').lower()
+        if self._runtime not in ['processes', 'asyncio']:
+            raise ConfigError('Failed to parse runtime: may be only "processes" or "asyncio".')
+        self._asyncio = Object(
+            queue_size=get_or_raise(self._cfg, 'datascraper', 'asyncio', 'queue_size', default=100),
+            filter_concurrency=get_or_raise(self._cfg, 'datascraper', 'asyncio', 'filter_concurrency', default=4),
+            write_concurrency=get_or_raise(self._cfg, 'datascraper', 'asyncio', 'write_concurrency', default=4),
+            notification_concurrency=get_or_raise(self._cfg, 'datascraper', 'asyncio', 'notification_concurrency',
+                                                  default=4),
+        )
+
+        self._fetcher = Object(
+            window_size=get_or_raise(self._cfg, 'datascraper', 'fetcher', 'window_size', default=0),
+            batch_size=get_or_raise(self._cfg, 'datascraper', 'fetcher', 'batch_size', default=5),
+            probe_interval=get_or_raise(self._cfg, 'datascraper', 'fetcher', 'probe_interval', default=30),
+        )
+        if self._fetcher.window_size and use_web_socket:
+            raise ConfigError('Block fetcher works only with HTTP nodes, set "use_websocket" to "no".')
+
+        # Pool is created once, so its health is shared by all processes started with this config
+        self._node_pool = NodePool(
+            self._nodes,
+            hedge_after=get_or_raise(self._cfg, 'datascraper', 'node_pool', 'hedge_after', default=0),
+            cooldown=get_or_raise(self._cfg, 'datascraper', 'node_pool', 'cooldown', default=30),
+        )
+
+        self._prefilter = Object(
+            authors=get_or_raise(self._cfg, 'datascraper', 'prefilter', 'authors', default=True),
+            reload_interval=get_or_raise(self._cfg, 'datascraper', 'prefilter', 'reload_interval', default=600),
+        )
+
+        self._identifier_index = Object(
+            enabled=get_or_raise(self._cfg, 'datascraper', 'identifier_index', 'enabled', default=True),
+            reload_interval=get_or_raise(self._cfg, 'datascraper', 'identifier_index', 'reload_interval',
+                                         default=3600),
+        )
+
+        self._indexes = Object(
+            create=get_or_raise(self._cfg, 'datascraper', 'indexes', 'create', default=True),
+            verify=get_or_raise(self._cfg, 'datascraper', 'indexes', 'verify', default=True),
+        )
+
+        self._connections = Object(
+            mongo_pool_size=get_or_raise(self._cfg, 'datascraper', 'connections', 'mongo_pool_size', default=10),
+            redis_pool_size=get_or_raise(self._cfg, 'datascraper', 'connections', 'redis_pool_size', default=10),
+            http_pool_size=get_or_raise(self._cfg, 'datascraper', 'connections', 'http_pool_size', default=10),
+        )
+
+        self._backfill = Object(
+            scrapers=get_or_raise(self._cfg, 'datascraper', 'backfill', 'scrapers', default=1),
+            range_size=get_or_raise(self._cfg, 'datascraper', 'backfill', 'range_size', default=100000),
         )
 
         self._post_operations = get_or_raise(self._cfg, 'datascraper', 'operation_types', 'post_operations', pop=True)
@@ -206,6 +476,10 @@ class Config(object):
         self._operation_types.extend(self._delegate_operations)
         self._operation_types.extend(self._transfer_operations)
         self._operation_types.extend(self._update_operations)
+        self._operation_routes = compile_operation_routes(
+            self._post_operations, self._delegate_operations, self._transfer_operations,
+            self._update_operations, self._notification.events
+        )
 
         self._chain_name = get_or_raise(self._cfg, 'datascraper', 'chain_name', pop=True).lower()
         self._server_type = get_or_raise(self._cfg, 'datascraper', 'server_type', pop=True).lower()
@@ -0,0 +1,170 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+import requests
+from requests import RequestException
+
+import datascraper.notification
+from datascraper.cache import PostIndex
+from datascraper.config import Object
+from datascraper.metrics import metrics
+from datascraper.resources import resources
+
+logger = logging.getLogger(__name__)
+
+# Put into the queue by `stop`, events queued before it are delivered
+_STOP = object()
+
+
+class NotificationDispatcher(object):
+    """Builds notification events and delivers them to notification API in a background thread.
+
+    Events are built by the thread which submits operations, because posts which aren't in `index`
+    or in `mongo` are fetched from blockchain by the shared steemd instance, which isn't thread-safe.
+    Built events are put into a bounded queue, so block processing never waits for the API:
+    when the queue is full, the event is dropped and counted. Events are sent through
+    a pooled session of the process with timeouts, in batches of `batch_size` if API accepts lists,
+    and failed deliveries are retried with exponential backoff.
+    Until `start` is called, events are delivered synchronously, `stop` delivers queued ones.
+    """
+
+    def __init__(self, options: Object, index: PostIndex = None):
+        self.options = options
+        self.index = index if index is not None else PostIndex(options.index_size, options.index_ttl)
+        self.mongo = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=options.queue_size)
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def session(self) -> requests.Session:
+        return resources.session('notification', {
+            'Content-type': 'application/json',
+            'Authorization': 'Token %s' % self.options.token
+        })
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='NotificationDispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> bool:
+        """Delivers queued notifications and stops the thread. Returns False if they aren't delivered in time."""
+        if not self.is_running:
+            return True
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error('Failed to stop notification dispatcher, %s notifications are lost.', self._queue.qsize())
+            return False
+        self._thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            logger.error('Notifications are not delivered within %ss, %s of them are lost.',
+                         timeout, self._queue.qsize())
+            return False
+        return True
+
+    def submit(self, operation: dict):
+        event = self.build_event(operation)
+        if not event:
+            return
+        if not self.is_running:
+            self._deliver([event])
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc('datascraper_notifications_total', result='dropped')
+            logger.warning('Notification queue is full, %s notification is dropped.', event['event_type'])
+
+    def build_event(self, operation: dict):
+        cls_name = self.options.events.get(operation['type'])
+        if not cls_name or not hasattr(datascraper.notification, cls_name):
+            return None
+        try:
+            return getattr(datascraper.notification, cls_name)(operation, self.mongo, self.index).json()
+        except Exception as e:
+            logger.exception('Failed to build notification for %s operation: %s', operation['type'], e)
+            return None
+
+    def _post(self, payload) -> bool:
+        for attempt in range(self.options.max_attempts):
+            if attempt:
+                metrics.inc('datascraper_retries_total', stage='notification')
+                time.sleep(self.options.backoff * 2 ** (attempt - 1))
+            try:
+                with metrics.timer('datascraper_stage_seconds', stage='notification'):
+                    resp = self.session.post(self.options.url, data=json.dumps(payload),
+                                             timeout=self.options.timeout)
+            except RequestException as error:
+                logger.warning('Failed to send notification, attempt %s: %s', attempt + 1, error)
+                continue
+            if 200 <= resp.status_code < 400:
+                logger.debug('Notification sent: %s', payload)
+                return True
+            if resp.status_code < 500:
+                logger.warning('Failed to send notification: %s. Error: %s', payload, resp.content)
+                return False
+            logger.warning('Failed to send notification, attempt %s: %s', attempt + 1, resp.content)
+        logger.error('Failed to send notification after %s attempts: %s', self.options.max_attempts, payload)
+        return False
+
+    def _deliver(self, events: list):
+        if self.options.batch_size > 1:
+            payloads = [events]
+        else:
+            payloads = events
+        for payload in payloads:
+            number = len(payload) if isinstance(payload, list) else 1
+            if self._post(payload):
+                self.sent += number
+                metrics.inc('datascraper_notifications_total', number, result='sent')
+            else:
+                self.failed += number
+                metrics.inc('datascraper_notifications_total', number, result='failed')
+
+    def _next_batch(self) -> list:
+        event = self._queue.get()
+        if event is _STOP:
+            self._stopping = True
+            return []
+        events = [event]
+        deadline = time.monotonic() + self.options.batch_interval
+        while len(events) < self.options.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is _STOP:
+                self._stopping = True
+                break
+            events.append(event)
+        return events
+
+    def _run(self):
+        while not self._stopping:
+            events = self._next_batch()
+            if events:
+                self._deliver(events)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,202 @@
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from steepcommon.lib.blockchain import Blockchain
+
+from datascraper.metrics import metrics
+from datascraper.nodes import BLOCK_INTERVAL, NodePool, NodesUnavailable
+from datascraper.resources import resources
+
+logger = logging.getLogger(__name__)
+
+
+class RPCError(Exception):
+    pass
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def format_operation(raw_operation: dict) -> dict:
+    """Converts operation from `get_ops_in_block` to the same format as `Blockchain.history` does.
+
+    `_id` is the hash of the raw operation, so operations of a block which is scraped again
+    are duplicates of already inserted ones.
+    """
+    op_type, op_data = raw_operation['op']
+    operation = dict(op_data)
+    operation.update({
+        '_id': Blockchain.hash_op(raw_operation),
+        'type': op_type,
+        'timestamp': parse_time(raw_operation['timestamp']),
+        'block_num': raw_operation['block'],
+        'trx_id': raw_operation['trx_id'],
+    })
+    return operation
+
+
+class BlockFetcher(object):
+    """Fetches operations of several blocks at once using JSON-RPC batch requests over HTTP.
+
+    Up to `window_size` blocks are requested concurrently in batches of `batch_size` blocks,
+    batches are sent to the healthiest node of the pool. Operations are yielded strictly in block order.
+    Head blocks of all nodes are probed every `probe_interval` seconds to find lagging nodes,
+    a batch is sent only to nodes which have reached all its blocks.
+    If `op_types` is set, operations of other types are skipped before they are converted.
+    """
+
+    def __init__(self, nodes: list, window_size: int = 20, batch_size: int = 5,
+                 timeout: float = 30, max_attempts: int = 5, pool: NodePool = None, probe_interval: float = 30,
+                 op_types=None):
+        self.nodes = [node for node in nodes if node.startswith('http')]
+        if not self.nodes:
+            raise ValueError('Block fetcher works only with HTTP nodes.')
+        self.window_size = max(window_size, batch_size)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.pool = pool if pool is not None else NodePool(self.nodes)
+        self.probe_interval = probe_interval
+        self.op_types = op_types
+        self.skipped = 0
+        self._probed_at = None
+        self._session = resources.session('rpc', pool_size=max(len(self.nodes), self.window_size // batch_size))
+        self._ids = itertools.count(1)
+
+    def _post(self, node: str, payload):
+        resp = self._session.post(node, data=json.dumps(payload), timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _call_node(self, node: str, method: str, params: list):
+        data = self._post(node, {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params})
+        if 'error' in data:
+            raise RPCError(data['error'])
+        return data['result']
+
+    def _get_ops_in_blocks_from_node(self, node: str, block_nums: list) -> dict:
+        payload = [
+            {'jsonrpc': '2.0', 'id': block_num, 'method': 'condenser_api.get_ops_in_block', 'params': [block_num, False]}
+            for block_num in block_nums
+        ]
+        responses = self._post(node, payload)
+        errors = [response['error'] for response in responses if 'error' in response]
+        if errors:
+            raise RPCError(errors[0])
+        return {response['id']: response['result'] for response in responses}
+
+    def _get_ops_in_blocks(self, block_nums: list) -> dict:
+        # A node which is behind returns no operations for blocks above its head instead of an error,
+        # so blocks are requested only from nodes which have already reached all of them
+        try:
+            with metrics.timer('datascraper_stage_seconds', stage='fetch'):
+                return self.pool.call(lambda node: self._get_ops_in_blocks_from_node(node, block_nums),
+                                      self.max_attempts, (requests.RequestException, ValueError, KeyError, RPCError),
+                                      min_head_block=max(block_nums))
+        except NodesUnavailable as e:
+            raise RPCError('Failed to get blocks %s-%s: %s' % (block_nums[0], block_nums[-1], e))
+
+    def _get_properties(self, node: str) -> dict:
+        """Returns dynamic global properties of the node and saves its head block to the pool."""
+        properties = self._call_node(node, 'condenser_api.get_dynamic_global_properties', [])
+        self.pool.record_head(node, properties['head_block_number'])
+        return properties
+
+    def _probe(self) -> int:
+        """Saves head blocks of all nodes to the pool, returns last irreversible block of the healthiest one."""
+        def probe_node(node: str):
+            try:
+                return self.pool.measure(self._get_properties, node)
+            except (requests.RequestException, ValueError, KeyError, RPCError) as e:
+                logger.warning('Failed to probe %s: %s', node, e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+            results = dict(zip(self.nodes, executor.map(probe_node, self.nodes)))
+        self._probed_at = time.monotonic()
+
+        results = {node: properties for node, properties in results.items() if properties}
+        if not results:
+            raise RPCError('Failed to get properties from all nodes.')
+        # Blocks will be requested from the healthiest node, lagging nodes rank lower
+        best_node = next(node for node in self.pool.ranked() if node in results)
+        return results[best_node]['last_irreversible_block_num']
+
+    def _probe_if_due(self):
+        if self._probed_at is None or time.monotonic() - self._probed_at >= self.probe_interval:
+            self._probe()
+
+    def get_last_irreversible_block_num(self) -> int:
+        if self._probed_at is None or time.monotonic() - self._probed_at >= self.probe_interval:
+            return self._probe()
+        # Head block of the node which answers is saved too, so the block is never above all known heads
+        try:
+            properties = self.pool.call(self._get_properties, self.max_attempts,
+                                        (requests.RequestException, ValueError, KeyError, RPCError))
+        except NodesUnavailable as e:
+            raise RPCError('Failed to get properties: %s' % e)
+        return properties['last_irreversible_block_num']
+
+    def _batches(self, start_block: int, end_block: int = None):
+        """Yields lists of block numbers, an empty list means that there are no new irreversible blocks yet."""
+        if end_block is not None and end_block < start_block:
+            for first in range(start_block, end_block - 1, -self.batch_size):
+                # Head blocks of nodes are needed to choose nodes which have the blocks
+                self._probe_if_due()
+                yield list(range(first, max(first - self.batch_size, end_block - 1), -1))
+            return
+
+        block_num = start_block
+        while end_block is None or block_num <= end_block:
+            head_block = self.get_last_irreversible_block_num()
+            if end_block is not None:
+                head_block = min(head_block, end_block)
+            if block_num > head_block:
+                yield []
+                continue
+            for first in range(block_num, head_block + 1, self.batch_size):
+                yield list(range(first, min(first + self.batch_size, head_block + 1)))
+            block_num = head_block + 1
+
+    def history(self, start_block: int, end_block: int = None):
+        """Yields operations from `start_block` to `end_block`, blocks go backward if `end_block` is less.
+
+        Without `end_block` follows the last irreversible block forever.
+        """
+        batches = self._batches(start_block, end_block)
+        pending = deque()
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=max(1, self.window_size // self.batch_size)) as executor:
+            while True:
+                while not exhausted and len(pending) * self.batch_size < self.window_size:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                    elif not batch:
+                        if not pending:
+                            time.sleep(BLOCK_INTERVAL)
+                        break
+                    else:
+                        pending.append((batch, executor.submit(self._get_ops_in_blocks, batch)))
+
+                if not pending:
+                    if exhausted:
+                        return
+                    continue
+
+                batch, future = pending.popleft()
+                operations = future.result()
+                for block_num in batch:
+                    for raw_operation in operations[block_num]:
+                        if self.op_types is not None and raw_operation['op'][0] not in self.op_types:
+                            self.skipped += 1
+                            continue
+                        yield format_operation(raw_operation)
@@ -0,0 +1,150 @@
+import json
+import logging
+import time
+
+from pymongo.errors import ConnectionFailure
+from redis import Redis
+from redis.exceptions import RedisError
+from steepcommon.conf import APP_COLLECTIONS
+from steepcommon.enums import CollectionType
+from steepcommon.mongo import consts
+from steepcommon.mongo.storage import MongoStorage
+from steepcommon.utils import retry
+
+logger = logging.getLogger(__name__)
+
+# Workers publish identifiers which they write or mark as deleted to this channel
+CHANNEL = 'datascraper:identifiers'
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+def _name(value) -> str:
+    return getattr(value, 'name', str(value))
+
+
+def publish_updates(redis_obj: Redis, updates: list):
+    """Publishes updates made by `IdentifierIndex.add_update`/`remove_update` in one round trip."""
+    if not updates:
+        return
+    try:
+        pipe = redis_obj.pipeline(transaction=False)
+        for update in updates:
+            pipe.publish(CHANNEL, json.dumps(update))
+        pipe.execute()
+    except RedisError as e:
+        logger.warning('Failed to publish %s identifier updates: %s', len(updates), e)
+
+
+class IdentifierIndex(object):
+    """Keeps hashes of all identifiers of posts and comments collections of every app in memory,
+    so ownership of an identifier is known without database queries.
+
+    The index is loaded from database every `reload_interval` seconds and between reloads is
+    updated by messages which workers publish to Redis channel. It subscribes before loading,
+    so no update is lost between the load and the first message.
+    """
+
+    def __init__(self, mongo: MongoStorage, redis_obj: Redis, reload_interval: float = 3600):
+        self.mongo = mongo
+        self.redis_obj = redis_obj
+        self.reload_interval = reload_interval
+        self.listeners = []
+        self._apps = {_name(app): app for app in APP_COLLECTIONS}
+        self._collection_types = {_name(collection_type): collection_type for collection_type in CollectionType}
+        self._hashes = {}
+        self._pubsub = None
+        self._loaded_at = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._loaded_at is not None
+
+    def __len__(self):
+        return sum(len(hashes) for hashes in self._hashes.values())
+
+    def _subscribe(self):
+        if self._pubsub is None:
+            self._pubsub = self.redis_obj.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(CHANNEL)
+
+    def load(self):
+        try:
+            self._subscribe()
+        except RedisError as e:
+            logger.error('Failed to subscribe to identifier updates: %s', e)
+            return
+
+        hashes = {}
+        for app, collections in APP_COLLECTIONS.items():
+            for collection_type in (CollectionType.posts, CollectionType.comments):
+                collection = getattr(self.mongo, collections[collection_type], None)
+                if not collection:
+                    continue
+                query = {}
+                if collection_type == CollectionType.posts:
+                    query[consts.DELETED_FIELD] = {'$ne': True}
+                res = retry(self._load_hashes, 5, ConnectionFailure)(collection, query)
+                if isinstance(res, Exception):
+                    logger.error('Failed to load identifiers from "%s": %s', collections[collection_type], res)
+                    return
+                hashes[(collection_type, app)] = res
+        self._hashes = hashes
+        self._loaded_at = time.monotonic()
+        logger.info('%s identifiers are loaded to index.', len(self))
+
+    @staticmethod
+    def _load_hashes(collection, query: dict) -> set:
+        return {hash(doc['identifier']) for doc in collection.find(query, {'identifier': 1, '_id': 0})
+                if doc.get('identifier')}
+
+    def add(self, collection_type, identifier: str, apps):
+        for app in apps:
+            self._hashes.setdefault((collection_type, app), set()).add(hash(identifier))
+
+    def remove(self, identifier: str):
+        """Forgets deleted post, deleted comments are kept the same way as they are kept in database lookups."""
+        identifier_hash = hash(identifier)
+        for (collection_type, _), hashes in self._hashes.items():
+            if collection_type == CollectionType.posts:
+                hashes.discard(identifier_hash)
+
+    def get_apps(self, collection_type, identifier: str) -> set:
+        identifier_hash = hash(identifier)
+        return {app for (hashes_type, app), hashes in self._hashes.items()
+                if hashes_type == collection_type and identifier_hash in hashes}
+
+    def refresh(self):
+        """Reloads the index when it's time and applies published updates, is called before every lookup."""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval:
+            self.load()
+        if self._pubsub is None:
+            return
+        try:
+            message = self._pubsub.get_message()
+            while message is not None:
+                self._apply(json.loads(message['data']))
+                message = self._pubsub.get_message()
+        except RedisError as e:
+            logger.warning('Failed to get identifier updates, index will be reloaded: %s', e)
+            self._pubsub = None
+            self._loaded_at = None
+
+    def _apply(self, update: list):
+        if update[0] == ADD:
+            _, collection_type, app, identifier = update
+            self.add(self._collection_types[collection_type], identifier, {self._apps[app]})
+        else:
+            identifier = update[1]
+            self.remove(identifier)
+        for listener in self.listeners:
+            listener(update)
+
+    @staticmethod
+    def add_update(collection_type, identifier: str, app) -> list:
+        return [ADD, _name(collection_type), _name(app), identifier]
+
+    @staticmethod
+    def remove_update(identifier: str) -> list:
+        return [REMOVE, identifier]
@@ -0,0 +1,81 @@
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from steepcommon.conf import APP_COLLECTIONS
+from steepcommon.enums import CollectionType
+from steepcommon.mongo import consts
+from steepcommon.mongo.storage import MongoStorage
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+def required_indexes() -> dict:
+    """Returns collection name -> list of (keys, options) of indexes which lookups and writes rely on."""
+    indexes = {
+        # Duplicates of curators are skipped by duplicate key errors
+        'Curators': [
+            ([('username', ASCENDING), ('trx_timestamp', ASCENDING), ('sum', ASCENDING), ('currency', ASCENDING)],
+             {'unique': True, 'name': 'curator_transfer_unique'}),
+        ],
+    }
+    for collections in APP_COLLECTIONS.values():
+        for collection_type in (CollectionType.posts, CollectionType.comments):
+            indexes.setdefault(collections[collection_type], [
+                ([('identifier', ASCENDING)], {'unique': True, 'name': 'identifier_unique'}),
+                # Authors of apps are loaded with `distinct`
+                ([('author', ASCENDING)], {'name': 'author'}),
+            ])
+    return indexes
+
+
+def hot_queries() -> list:
+    """Returns (collection name, filter) of queries which are made for every operation."""
+    queries = [
+        ('Curators', {'username': '', 'trx_timestamp': datetime(1970, 1, 1), 'sum': 0, 'currency': ''}),
+    ]
+    for collections in APP_COLLECTIONS.values():
+        queries.append((collections[CollectionType.posts], {'identifier': '', consts.DELETED_FIELD: {'$ne': True}}))
+        queries.append((collections[CollectionType.comments], {'identifier': ''}))
+    return queries
+
+
+def ensure_indexes(mongo: MongoStorage) -> int:
+    """Creates missing indexes. Returns number of indexes which failed to be created."""
+    failed = 0
+    for collection_name, indexes in required_indexes().items():
+        collection = getattr(mongo, collection_name)
+        for keys, options in indexes:
+            try:
+                collection.create_index(keys, background=True, **options)
+            except OperationFailure as e:
+                # E.g. an index with the same keys but other name or duplicates in the collection
+                failed += 1
+                logger.error('Failed to create index %s on "%s": %s', options['name'], collection_name, e)
+    return failed
+
+
+def _stages(plan: dict):
+    yield plan.get('stage')
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            yield from _stages(child)
+
+
+def verify_query_plans(mongo: MongoStorage):
+    """Raises QueryPlanError if any of hot queries would scan the whole collection."""
+    scans = []
+    for collection_name, query in hot_queries():
+        plan = getattr(mongo, collection_name).find(query).limit(1).explain()
+        winning_plan = plan.get('queryPlanner', {}).get('winningPlan', {})
+        if 'COLLSCAN' in _stages(winning_plan):
+            scans.append(collection_name)
+            logger.error('Query %s on "%s" scans the whole collection.', query, collection_name)
+    if scans:
+        raise QueryPlanError('Queries on %s scan whole collections, create indexes for them.' % ', '.join(scans))
+    logger.info('Query plans of %s hot queries use indexes.', len(hot_queries()))
@@ -1,26 +1,55 @@
 import argparse
 import logging.config
 import multiprocessing
-import os
 import time
 
-from redis import Redis
 from redis.exceptions import RedisError
 from steepcommon.lib import Steem
 from steepcommon.lib.blockchain import Blockchain
-from steepcommon.mongo.storage import MongoStorage, Settings
+from steepcommon.mongo.storage import Settings
 
+from datascraper.autoscaler import WorkerAutoscaler, WorkerPool
+from datascraper.backfill import BackfillCoordinator, RangeCheckpoints
+from datascraper.checkpoint import CheckpointTracker, pending_key
 from datascraper.config import Config, ConfigError
-from datascraper.scraper import ScrapeProcess
-from datascraper.worker import WorkerProcess
+from datascraper.scraper import RangeScrapeProcess, ScrapeProcess
+from datascraper.supervisor import ON_FAILURE, Supervisor
+from datascraper.indexes import QueryPlanError, ensure_indexes, verify_query_plans
 from datascraper.logging_conf import get_logging_conf
+from datascraper.metrics import MetricsServer, read_metrics, series
+from datascraper.pipeline import run_pipelines
+from datascraper.resources import resources
 
 logger = logging.getLogger(__name__)
 
 
-# TODO: We can monitor backward process here and terminate it when reach first block of blockchain
-# def inspector(redis_objs: dict, backward_process):
-def inspector(redis_objs: dict):
+def collect_metrics(redis_objs: dict, settings: Settings, blockchain: Blockchain) -> dict:
+    """Returns metrics flushed by all processes together with current state of queues and settings."""
+    values = read_metrics(redis_objs.values())
+    for db_name in ('forward_db', 'backward_db'):
+        redis_obj = redis_objs[db_name]
+        values[series('datascraper_queue_length', queue=db_name)] = redis_obj.llen(db_name)
+        values[series('datascraper_pending_blocks', queue=db_name)] = redis_obj.zcard(pending_key(db_name))
+
+    last_block = settings.last_block()
+    values[series('datascraper_last_block', direction='forward')] = last_block
+    values[series('datascraper_last_block', direction='backward')] = settings.last_reversed_block()
+    try:
+        values[series('datascraper_head_lag_blocks', direction='forward')] = \
+            blockchain.get_current_block_num() - last_block
+    except Exception as e:
+        logger.warning('Failed to get current block: %s', e)
+    return values
+
+
+def inspector(config: Config):
+    redis_objs = {db_name: resources.redis(db_name) for db_name in config.redis_databases}
+    if config.metrics.port:
+        settings = Settings(resources.mongo())
+        blockchain = Blockchain(steemd_instance=Steem(nodes=config.node_pool.ranked()), mode='irreversible')
+        MetricsServer(lambda: collect_metrics(redis_objs, settings, blockchain),
+                      config.metrics.host, config.metrics.port).start()
+
     while True:
         for db_name, redis_obj in redis_objs.items():
             # if db_name == 'backward_db' and (not backward_process.is_alive() and redis_obj.llen(db_name) == 0):
@@ -28,35 +57,46 @@ def inspector(redis_objs: dict):
             logger.debug('Number of elements {number} in '
                         '"{db_name}" database.'.format(number=redis_obj.llen(db_name),
                                                        db_name=db_name))
+        logger.debug('Connections of %s: %s', multiprocessing.current_process().name, resources.stats())
         time.sleep(30)
 
 
-def block_updater(redis_result_obj: Redis, config: Config):
+def block_updater(config: Config):
     # TODO: handle exception
-    mongo = MongoStorage(config.mongo_uri)
+    redis_objs = {db_name: resources.redis(db_name) for db_name in config.redis_databases}
+    mongo = resources.mongo()
     settings = Settings(mongo)
+    range_checkpoints = RangeCheckpoints(mongo) if config.backfill.scrapers > 1 else None
 
-    while True:
-        last_block = settings.last_block()
-        last_reversed_block = settings.last_reversed_block()
-
-        blocks = redis_result_obj.sort('forward_db')
-        reversed_blocks = redis_result_obj.sort('backward_db')
+    forward_tracker = CheckpointTracker(redis_objs['forward_db'], redis_objs['result_db'],
+                                        'forward_db', reversed_mode=False)
+    backward_tracker = CheckpointTracker(redis_objs['backward_db'], redis_objs['result_db'],
+                                         'backward_db', reversed_mode=True)
 
-        if not blocks and not reversed_blocks:
-            time.sleep(3)
-
-        if blocks:
-            for block in blocks:
-                if int(block) > last_block:
-                    settings.update_last_block(int(block))
-                    redis_result_obj.lrem('forward_db', block)
+    last_block = settings.last_block()
+    last_reversed_block = settings.last_reversed_block()
 
-        if reversed_blocks:
-            for block in reversed_blocks:
-                if int(block) < last_reversed_block:
-                    settings.update_last_reversed_block(int(block))
-                    redis_result_obj.lrem('backward_db', block)
+    while True:
+        checkpoint = forward_tracker.checkpoint()
+        if checkpoint is not None and checkpoint > last_block:
+            last_block = checkpoint
+            settings.update_last_block(last_block)
+            forward_tracker.trim(last_block)
+
+        if range_checkpoints:
+            range_checkpoints.update(backward_tracker)
+            checkpoint = range_checkpoints.last_block()
+            if checkpoint is not None and checkpoint < last_reversed_block:
+                last_reversed_block = checkpoint
+                settings.update_last_reversed_block(last_reversed_block)
+        else:
+            checkpoint = backward_tracker.checkpoint()
+            if checkpoint is not None and checkpoint < last_reversed_block:
+                last_reversed_block = checkpoint
+                settings.update_last_reversed_block(last_reversed_block)
+                backward_tracker.trim(last_reversed_block)
+
+        time.sleep(config.checkpoint_interval)
 
 
 def datascraper():
@@ -73,12 +113,23 @@ def datascraper():
     logging.config.dictConfig(get_logging_conf(cfg.log_path, cfg.chain_name, cfg.server_type))
     logger.info('Logger config has been successfully loaded.')
 
+    resources.configure(cfg)
+
     steem = Steem(nodes=cfg.nodes)
     blockchain = Blockchain(steemd_instance=steem, mode="irreversible")
 
-    mongo = MongoStorage(cfg.mongo_uri)
+    mongo = resources.mongo()
     settings = Settings(mongo)
 
+    if cfg.indexes.create:
+        ensure_indexes(mongo)
+    if cfg.indexes.verify:
+        try:
+            verify_query_plans(mongo)
+        except QueryPlanError as e:
+            logger.error('Failed to verify query plans: %s', e)
+            raise
+
     last_block = settings.last_block()
     last_reversed_block = settings.last_reversed_block()
 
@@ -88,58 +139,66 @@ def datascraper():
         settings.update_last_block(last_block)
         settings.update_last_reversed_block(last_reversed_block)
 
-    redis_objs = {}
+    if cfg.runtime == 'asyncio':
+        logger.info('Start scraping with asyncio runtime.')
+        run_pipelines(cfg)
+        return
+
+    # Processes are given only names of databases, clients are created by every process itself
+    redis_objs = {db_name: resources.redis(db_name) for db_name in cfg.redis_databases}
 
     try:
-        for db_name, index in cfg.redis_databases.items():
-            client = Redis(host=cfg.redis_host, port=cfg.redis_port, db=index)
+        for client in redis_objs.values():
             client.flushdb()
-            redis_objs[db_name] = client
     except RedisError as error:
         logger.error(error)
         return
 
-    max_number_workers = min(4, os.cpu_count())
-
-    forward_process = ScrapeProcess(name='ForwardProcess', config=cfg,
-                                    redis_obj=redis_objs['forward_db'],
-                                    redis_list_name='forward_db',
-                                    reversed_mode=False, daemon=False)
-    forward_process.start()
-
-    for number in range(max_number_workers):
-        worker = WorkerProcess(name='Worker-{}-Forward'.format(number),
-                               redis_obj=redis_objs['forward_db'],
-                               redis_result_obj=redis_objs['result_db'],
-                               redis_list_name='forward_db', config=cfg,
-                               reversed_mode=False, daemon=False,
-                               polling_freq=0.2)
-        worker.start()
-
-    # TODO: Need to implement the ability to perform backward scraping using a few processes
-    backward_process = ScrapeProcess(name='BackwardProcess', config=cfg,
-                                     redis_obj=redis_objs['backward_db'],
-                                     redis_list_name='backward_db',
-                                     reversed_mode=True, daemon=False)
-    backward_process.start()
-
-    for number in range(max_number_workers):
-        worker = WorkerProcess(name='Worker-{}-Backward'.format(number),
-                               redis_obj=redis_objs['backward_db'],
-                               redis_result_obj=redis_objs['result_db'],
-                               redis_list_name='backward_db', config=cfg,
-                               reversed_mode=True, daemon=False,
-                               polling_freq=1)
-        worker.start()
-
-    inspector_process = multiprocessing.Process(target=inspector, name='InspectorProcess',
-                                                # args=(redis_objs, backward_process,))
-                                                args=(redis_objs,))
-    inspector_process.start()
-
-    block_updater_process = multiprocessing.Process(target=block_updater, name='BlockUpdaterProcess',
-                                                    args=(redis_objs['result_db'], cfg,))
-    block_updater_process.start()
+    autoscaler = WorkerAutoscaler([
+        WorkerPool(cfg, redis_objs['forward_db'], 'forward_db', reversed_mode=False, polling_freq=0.2),
+        WorkerPool(cfg, redis_objs['backward_db'], 'backward_db', reversed_mode=True, polling_freq=1),
+    ], cfg.autoscaling.interval, cfg.autoscaling.drain_time)
+    supervisor = Supervisor(autoscaler, backoff=cfg.supervisor.backoff, max_backoff=cfg.supervisor.max_backoff,
+                            shutdown_timeout=cfg.supervisor.shutdown_timeout,
+                            final_delay=cfg.checkpoint_interval * 2)
+
+    supervisor.add('ForwardProcess', lambda: ScrapeProcess(name='ForwardProcess', config=cfg,
+                                                           redis_obj=None,
+                                                           redis_list_name='forward_db',
+                                                           reversed_mode=False, daemon=False),
+                   scraper=True)
+
+    if cfg.backfill.scrapers > 1:
+        coordinator = BackfillCoordinator(mongo, cfg.backfill.range_size)
+        coordinator.prepare(last_reversed_block)
+
+        def return_range(process: RangeScrapeProcess):
+            if process.current_range.value:
+                range_id = process.current_range.value.decode()
+                logger.info('Range %s of %s is returned to the queue.', range_id, process.name)
+                coordinator.queue.put(range_id)
+
+        for number in range(cfg.backfill.scrapers):
+            name = 'BackwardProcess-{}'.format(number)
+            supervisor.add(name, lambda name=name: RangeScrapeProcess(name=name, config=cfg,
+                                                                      redis_obj=None,
+                                                                      redis_list_name='backward_db',
+                                                                      ranges_queue=coordinator.queue,
+                                                                      daemon=False),
+                           restart=ON_FAILURE, on_exit=return_range, scraper=True)
+    else:
+        supervisor.add('BackwardProcess', lambda: ScrapeProcess(name='BackwardProcess', config=cfg,
+                                                                redis_obj=None,
+                                                                redis_list_name='backward_db',
+                                                                reversed_mode=True, daemon=False),
+                       restart=ON_FAILURE, scraper=True)
+
+    supervisor.add('InspectorProcess', lambda: multiprocessing.Process(target=inspector, name='InspectorProcess',
+                                                                       args=(cfg,)))
+    supervisor.add('BlockUpdaterProcess', lambda: multiprocessing.Process(target=block_updater,
+                                                                          name='BlockUpdaterProcess',
+                                                                          args=(cfg,)))
+    supervisor.run()
 
 
 if __name__ == '__main__':
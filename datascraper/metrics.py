@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Every process adds its counters to this hash, so the endpoint shows sums over all processes
+REDIS_KEY = 'metrics'
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+METRICS = {
+    'datascraper_blocks_total': ('counter', 'Number of blocks scraped or processed by workers.'),
+    'datascraper_operations_total': ('counter', 'Number of operations scraped or processed by workers.'),
+    'datascraper_stage_seconds': ('histogram', 'Latency of pipeline stages.'),
+    'datascraper_cache_requests_total': ('counter', 'Number of cache lookups.'),
+    'datascraper_retries_total': ('counter', 'Number of retries of failed calls.'),
+    'datascraper_notifications_total': ('counter', 'Number of notifications by result of delivery.'),
+    'datascraper_redis_connections': ('gauge', 'Number of connections in Redis pools of all processes.'),
+    'datascraper_queue_length': ('gauge', 'Number of blocks in Redis queue.'),
+    'datascraper_pending_blocks': ('gauge', 'Number of dispatched blocks which are not completed yet.'),
+    'datascraper_last_block': ('gauge', 'Last synced block.'),
+    'datascraper_head_lag_blocks': ('gauge', 'Number of blocks between the last irreversible block and the last synced one.'),
+}
+
+
+def series(name: str, **labels) -> str:
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (key, labels[key]) for key in sorted(labels)))
+
+
+def direction(reversed_mode: bool) -> str:
+    return 'backward' if reversed_mode else 'forward'
+
+
+def cache_series(cache_name: str, cache) -> dict:
+    """Returns counters of LRUCache, to be passed to `Metrics.track`."""
+    return {
+        series('datascraper_cache_requests_total', cache=cache_name, result='hit'): cache.hits,
+        series('datascraper_cache_requests_total', cache=cache_name, result='miss'): cache.misses,
+    }
+
+
+class Metrics(object):
+    """Counters and histograms of one process.
+
+    Values are collected locally and every `flush_interval` seconds are added to a Redis hash
+    shared by all processes. Without Redis values stay in the process and are served by itself.
+    """
+
+    def __init__(self):
+        self.redis_obj = None
+        self.flush_interval = 10
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+        self._tracked = []
+        self._flushed_at = time.monotonic()
+
+    def configure(self, redis_obj: Redis = None, flush_interval: float = 10):
+        """Is called once in every process, values inherited from parent process are discarded."""
+        with self._lock:
+            self.redis_obj = redis_obj
+            self.flush_interval = flush_interval
+            self._values.clear()
+            self._tracked.clear()
+            self._flushed_at = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._values[series(name, **labels)] += value
+        self.maybe_flush()
+
+    def observe(self, name: str, seconds: float, **labels):
+        with self._lock:
+            for bucket in BUCKETS:
+                if seconds <= bucket:
+                    self._values[series(name + '_bucket', le='+Inf' if bucket == float('inf') else bucket,
+                                        **labels)] += 1
+            self._values[series(name + '_sum', **labels)] += seconds
+            self._values[series(name + '_count', **labels)] += 1
+        self.maybe_flush()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def track(self, func: Callable[[], dict]):
+        """Registers function which returns counters kept by other objects, e.g. hits of a cache."""
+        with self._lock:
+            self._tracked.append([func, {}])
+
+    def _tracked_deltas(self) -> dict:
+        deltas = defaultdict(float)
+        for tracked in self._tracked:
+            func, reported = tracked
+            values = func()
+            for key, value in values.items():
+                deltas[key] += value - reported.get(key, 0)
+            tracked[1] = values
+        return deltas
+
+    def snapshot(self) -> dict:
+        """Returns values of this process which are not flushed to Redis."""
+        with self._lock:
+            values = dict(self._values)
+            for func, reported in self._tracked:
+                for key, value in func().items():
+                    values[key] = values.get(key, 0) + value - reported.get(key, 0)
+        return values
+
+    def maybe_flush(self):
+        if self.redis_obj is not None and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.redis_obj is None:
+            return
+        with self._lock:
+            values = self._values
+            for key, value in self._tracked_deltas().items():
+                values[key] += value
+            self._values = defaultdict(float)
+            self._flushed_at = time.monotonic()
+
+        values = {key: value for key, value in values.items() if value}
+        if not values:
+            return
+        try:
+            pipe = self.redis_obj.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.hincrbyfloat(REDIS_KEY, key, value)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning('Failed to flush metrics: %s', e)
+            with self._lock:
+                for key, value in values.items():
+                    self._values[key] += value
+
+
+metrics = Metrics()
+
+
+def read_metrics(redis_objs) -> dict:
+    """Sums values flushed by all processes to the given Redis databases."""
+    values = defaultdict(float)
+    for redis_obj in redis_objs:
+        for key, value in redis_obj.hgetall(REDIS_KEY).items():
+            values[key.decode() if isinstance(key, bytes) else key] += float(value)
+    return values
+
+
+def _metric_name(key: str) -> str:
+    name = key.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        base = name[:-len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ('',))[0] == 'histogram':
+            return base
+    return name
+
+
+def render(values: dict) -> str:
+    """Formats values in Prometheus text exposition format."""
+    groups = OrderedDict()
+    for key in sorted(values):
+        groups.setdefault(_metric_name(key), []).append(key)
+
+    lines = []
+    for name, keys in groups.items():
+        if name in METRICS:
+            metric_type, description = METRICS[name]
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+        for key in keys:
+            lines.append('%s %r' % (key, float(values[key])))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """Serves values returned by `collect` on /metrics in a background thread."""
+
+    def __init__(self, collect: Callable[[], dict], host: str = '127.0.0.1', port: int = 9100):
+        self.collect = collect
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = render(server.collect()).encode()
+                except Exception as e:
+                    logger.exception('Failed to collect metrics: %s', e)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True).start()
+        logger.info('Metrics are served on http://%s:%s/metrics', *self._server.server_address[:2])
+        return self
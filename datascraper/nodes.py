@@ -0,0 +1,166 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+from datascraper.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOCK_INTERVAL = 3  # seconds
+
+# Fields of every node in the shared array
+LATENCY = 0
+ERROR_RATE = 1
+HEAD_BLOCK = 2
+DISABLED_UNTIL = 3
+FIELDS = 4
+
+
+class NodesUnavailable(Exception):
+    pass
+
+
+class NodePool(object):
+    """Keeps health of RPC nodes and routes requests to the healthiest one.
+
+    Latency and error rate of every node are exponentially weighted moving averages,
+    head block lag is counted from the greatest head block among nodes. A failed node is
+    disabled for `cooldown` seconds. Health is kept in shared memory, so the pool created
+    before processes are started is shared by all scrapers and workers.
+
+    Score of node is `latency * (1 + 4 * error_rate) + lag * BLOCK_INTERVAL`, the lower the better.
+    Nodes without measurements have zero latency, so every node is tried. Requests which need a block
+    are sent only to nodes whose recorded head block is not less than `min_head_block`.
+    """
+
+    def __init__(self, nodes: list, hedge_after: float = 0, cooldown: float = 30, smoothing: float = 0.3):
+        self.nodes = list(nodes)
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self._health = multiprocessing.Array('d', len(self.nodes) * FIELDS)
+        self._executor = None
+
+    def _field(self, index: int, field: int) -> float:
+        return self._health[index * FIELDS + field]
+
+    def _score(self, index: int, head_block: float) -> float:
+        lag = max(0, head_block - self._field(index, HEAD_BLOCK)) if self._field(index, HEAD_BLOCK) else 0
+        return self._field(index, LATENCY) * (1 + 4 * self._field(index, ERROR_RATE)) + lag * BLOCK_INTERVAL
+
+    def ranked(self, exclude=(), min_head_block: int = 0) -> list:
+        """Returns nodes from the healthiest one, disabled nodes go last."""
+        now = time.time()
+        with self._health.get_lock():
+            head_block = max(self._field(index, HEAD_BLOCK) for index in range(len(self.nodes)))
+            keys = {
+                node: (self._field(index, DISABLED_UNTIL) > now, self._score(index, head_block))
+                for index, node in enumerate(self.nodes)
+                if node not in exclude and self._field(index, HEAD_BLOCK) >= min_head_block
+            }
+        return sorted(keys, key=keys.get)
+
+    def select(self, exclude=(), min_head_block: int = 0) -> str:
+        nodes = self.ranked(exclude, min_head_block)
+        if not nodes:
+            raise NodesUnavailable('No nodes left to try.')
+        return nodes[0]
+
+    def _update(self, node: str, latency: float = None, error: bool = False):
+        index = self.nodes.index(node)
+        offset = index * FIELDS
+        with self._health.get_lock():
+            error_rate = self._health[offset + ERROR_RATE]
+            self._health[offset + ERROR_RATE] = error_rate + self.smoothing * (float(error) - error_rate)
+            if latency is not None:
+                previous = self._health[offset + LATENCY]
+                self._health[offset + LATENCY] = latency if not previous else \
+                    previous + self.smoothing * (latency - previous)
+            if error:
+                self._health[offset + DISABLED_UNTIL] = time.time() + self.cooldown
+
+    def record_success(self, node: str, latency: float):
+        self._update(node, latency)
+
+    def record_failure(self, node: str):
+        self._update(node, error=True)
+        metrics.inc('datascraper_retries_total', stage='rpc', node=node)
+
+    def record_head(self, node: str, head_block: int):
+        with self._health.get_lock():
+            self._health[self.nodes.index(node) * FIELDS + HEAD_BLOCK] = head_block
+
+    def measure(self, request: Callable[[str], object], node: str):
+        started = time.monotonic()
+        try:
+            result = request(node)
+        except Exception:
+            self.record_failure(node)
+            raise
+        self.record_success(node, time.monotonic() - started)
+        return result
+
+    def call(self, request: Callable[[str], object], max_attempts: int = 3, errors=(Exception,),
+             min_head_block: int = 0):
+        """Calls `request(node)` on the healthiest node and fails over to the next ones.
+
+        If `hedge_after` is set and the node doesn't respond in time, the same request is sent
+        to the next node too, the first successful response is returned. If `min_head_block` is set,
+        nodes which haven't reached this block or whose head block is unknown are never called.
+        """
+        tried = []
+        error = None
+        for _ in range(max_attempts):
+            try:
+                node = self.select(exclude=tried, min_head_block=min_head_block)
+            except NodesUnavailable:
+                break
+            tried.append(node)
+            try:
+                if self.hedge_after and len(tried) < len(self.nodes):
+                    return self._hedged_call(request, node, tried, errors, min_head_block)
+                return self.measure(request, node)
+            except errors as e:
+                logger.warning('Request to %s failed: %s', node, e)
+                error = e
+        raise NodesUnavailable('Request failed on nodes %s: %s' % (', '.join(tried), error))
+
+    def _hedged_call(self, request: Callable[[str], object], node: str, tried: list, errors,
+                     min_head_block: int = 0):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2 * len(self.nodes))
+
+        futures = {self._executor.submit(self.measure, request, node): node}
+        done, _ = wait(futures, timeout=self.hedge_after)
+        hedge_nodes = self.ranked(exclude=tried, min_head_block=min_head_block) if not done else []
+        if hedge_nodes:
+            hedge_node = hedge_nodes[0]
+            tried.append(hedge_node)
+            logger.debug('%s is slow, request is hedged to %s.', node, hedge_node)
+            futures[self._executor.submit(self.measure, request, hedge_node)] = hedge_node
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except errors as e:
+                    logger.warning('Request to %s failed: %s', futures[future], e)
+                    error = e
+        raise error
+
+    def stats(self) -> dict:
+        with self._health.get_lock():
+            return {
+                node: {
+                    'latency': self._field(index, LATENCY),
+                    'error_rate': self._field(index, ERROR_RATE),
+                    'head_block': int(self._field(index, HEAD_BLOCK)),
+                    'disabled': self._field(index, DISABLED_UNTIL) > time.time(),
+                }
+                for index, node in enumerate(self.nodes)
+            }
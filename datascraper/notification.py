@@ -1,11 +1,14 @@
-from steepcommon.lib.post import Post
+from steepcommon.mongo.storage import MongoStorage
 
-from datascraper.utils import Operation
+from datascraper.cache import PostIndex
+from datascraper.utils import Operation, get_post_info
 
 
 class BaseEvent:
-    def __init__(self, operation: dict):
+    def __init__(self, operation: dict, mongo: MongoStorage = None, index: PostIndex = None):
         self.operation = Operation(operation)
+        self.mongo = mongo
+        self.index = index
         self.event_type = self.get_event_type()
         self.initiator = self.get_initiator()
         self.action_object = self.get_action_object()
@@ -29,8 +32,6 @@ class BaseEvent:
 
 class VoteEvent(BaseEvent):
     def get_event_type(self) -> str:
-        identifier = self.get_action_object()
-        p = Post(identifier)
         weight = int(self.operation['weight'])
         if weight > 0:
             vote_type = 'upvote'
@@ -38,7 +39,7 @@ class VoteEvent(BaseEvent):
             vote_type = 'downvote'
         else:
             vote_type = 'flag'
-        if p.is_comment():
+        if get_post_info(self.get_action_object(), self.mongo, self.index).is_comment:
             return vote_type + '_comment'
         return vote_type
 
@@ -60,8 +61,8 @@ class CommentEvent(BaseEvent):
 
     def get_action_object(self) -> str:
         if self.operation['parent_author']:
-            root_post = Post('@%s/%s' % (self.operation['parent_author'], self.operation['parent_permlink']))
-            return root_post.root_identifier
+            parent_identifier = self.operation.get_parent_identifier()
+            return get_post_info(parent_identifier, self.mongo, self.index).root_identifier
         return self.operation.get_identifier()
 
 
@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from steepcommon.lib.blockchain import Blockchain
+from steepcommon.mongo.storage import Settings
+
+from datascraper.bulk import BulkWriter
+from datascraper.cache import PostIndex
+from datascraper.checkpoint import BlockSequence
+from datascraper.config import Config
+from datascraper.metrics import MetricsServer, direction, metrics
+from datascraper.prefilter import AuthorPrefilter
+from datascraper.resources import resources
+from datascraper.scraper import ScrapeProcess
+from datascraper.worker import WorkerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPipeline(object):
+    """Scrapes blockchain in one direction inside a single process.
+
+    Fetching, filtering, writing to database and sending notifications are asyncio stages
+    connected by bounded queues. Every stage runs the configured number of tasks, blocking
+    calls of steem, pymongo and requests libraries are executed in a thread pool.
+    Every task uses its own scraper or worker object, they are never started as processes.
+
+    Blocks may be written out of order, so the last synced block is the end of the contiguous
+    prefix of completed blocks. It's saved to settings at most once per `checkpoint_interval`.
+    """
+
+    def __init__(self, config: Config, reversed_mode: bool = False):
+        self.config = config
+        self.reversed_mode = reversed_mode
+        self.name = 'Backward' if reversed_mode else 'Forward'
+        self.mongo = None
+        self.settings = None
+        self._loop = None
+        self._executor = None
+        self.blocks = None
+        self._saved_block = None
+        self._finished = None
+        # Workers of write tasks, their scheduled updates are run when the pipeline is finished
+        self.writers = []
+        # Written posts are indexed by write tasks and looked up by notification tasks
+        self.post_index = PostIndex(config.notification.index_size, config.notification.index_ttl)
+
+    def _make_scraper(self) -> ScrapeProcess:
+        scraper = ScrapeProcess(name='%sScraper' % self.name, config=self.config, redis_list_name=None,
+                                redis_obj=None, reversed_mode=self.reversed_mode)
+        scraper.mongo = self.mongo
+        if self.config.prefilter.authors:
+            scraper.author_prefilter = AuthorPrefilter(self.mongo, self.config.prefilter.reload_interval)
+        return scraper
+
+    def _make_worker(self) -> WorkerProcess:
+        worker = WorkerProcess(name='%sWorker' % self.name, redis_obj=None, redis_result_obj=None,
+                               redis_list_name=None, config=self.config, reversed_mode=self.reversed_mode,
+                               daemon=None, polling_freq=0)
+        worker.mongo = self.mongo
+        worker.post_index = self.post_index
+        worker.notifier.index = self.post_index
+        worker.notifier.mongo = self.mongo
+        worker.bulk_writer = BulkWriter(self.mongo)
+        return worker
+
+    def _make_writer(self) -> WorkerProcess:
+        worker = self._make_worker()
+        self.writers.append(worker)
+        return worker
+
+    def _run_in_executor(self, func, *args):
+        return self._loop.run_in_executor(self._executor, func, *args)
+
+    def _get_last_block(self) -> int:
+        return self.settings.last_reversed_block() if self.reversed_mode else self.settings.last_block()
+
+    def _fetch(self, queue: asyncio.Queue):
+        """Runs in a separate thread: groups operations by blocks and puts them into the queue."""
+        scraper = self._make_scraper()
+        blockchain = Blockchain(steemd_instance=scraper.steem, mode='irreversible')
+        last_block = self._get_last_block()
+
+        for attempt in range(self.config.max_attempts):
+            try:
+                history = scraper._get_history(blockchain, last_block)
+                for block_num, operations in itertools.groupby(history, key=lambda op: op['block_num']):
+                    operations = [op for op in operations if op['type'] in self.config.operation_routes]
+                    if operations:
+                        self.blocks.dispatch(block_num)
+                        asyncio.run_coroutine_threadsafe(queue.put(operations), self._loop).result()
+                        metrics.inc('datascraper_blocks_total', stage='scraped', direction=direction(self.reversed_mode))
+                    else:
+                        self.blocks.skip(block_num)
+                    last_block = block_num
+                    if block_num % 100 == 0:
+                        logger.info('%s pipeline - #%s', self.name, block_num)
+                logger.info('%s pipeline has fetched all blocks.', self.name)
+                return
+            except Exception as e:
+                logger.exception('%s pipeline failed to fetch operations, attempt %s: %s', self.name, attempt + 1, e)
+        logger.error('The maximum number of attempts is reached: %s.', self.config.max_attempts)
+
+    def _filter_block(self, scraper: ScrapeProcess, operations: list) -> list:
+        return [operation for operation in operations if scraper._check_operation(operation)]
+
+    def _flush_writer(self, worker: WorkerProcess, force: bool = False):
+        worker._run_scheduled_updates(force)
+        with metrics.timer('datascraper_stage_seconds', stage='write', direction=direction(self.reversed_mode)):
+            worker.bulk_writer.flush()
+        # Filter tasks of pipeline don't use identifier index, so there's no one to publish updates to
+        worker.identifier_updates.clear()
+
+    def _complete_written(self, worker: WorkerProcess):
+        """Completes written blocks of the worker, blocks with scheduled updates wait for them."""
+        completed_seq = worker.completed_seq()
+        while worker.written_blocks and worker.written_blocks[0][2] <= completed_seq:
+            self.blocks.complete(worker.written_blocks.pop(0)[0])
+
+    def _write_block(self, worker: WorkerProcess, operations: list):
+        worker._process_operations(operations, send_notifications=False)
+        self._flush_writer(worker)
+
+        worker.written_blocks.append((operations[0]['block_num'], None, worker.block_seq))
+        self._complete_written(worker)
+        metrics.inc('datascraper_blocks_total', stage='processed', direction=direction(self.reversed_mode))
+        metrics.inc('datascraper_operations_total', len(operations), stage='processed',
+                    direction=direction(self.reversed_mode))
+
+    def _finish_writer(self, worker: WorkerProcess):
+        self._flush_writer(worker, force=True)
+        self._complete_written(worker)
+
+    def _save_checkpoint(self):
+        checkpoint = self.blocks.checkpoint()
+        if self.reversed_mode:
+            if checkpoint < self._saved_block:
+                self.settings.update_last_reversed_block(checkpoint)
+                self._saved_block = checkpoint
+        elif checkpoint > self._saved_block:
+            self.settings.update_last_block(checkpoint)
+            self._saved_block = checkpoint
+
+    async def _save_checkpoints(self):
+        while not self._finished.is_set():
+            try:
+                await asyncio.wait_for(self._finished.wait(), self.config.checkpoint_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._run_in_executor(self._save_checkpoint)
+
+    async def _run_stage(self, name: str, concurrency: int, make_handler, process,
+                         source: asyncio.Queue, target: asyncio.Queue = None):
+        async def run_task():
+            handler = make_handler()
+            while True:
+                item = await source.get()
+                if item is None:
+                    return
+                try:
+                    result = await process(handler, item)
+                except Exception as e:
+                    logger.exception('%s pipeline failed on stage "%s": %s', self.name, name, e)
+                    continue
+                if target is not None and result:
+                    await target.put(result)
+
+        await asyncio.gather(*[run_task() for _ in range(concurrency)])
+
+    async def _filter(self, scraper: ScrapeProcess, operations: list) -> list:
+        result = await self._run_in_executor(self._filter_block, scraper, operations)
+        if not result:
+            # Nothing to write, the block is done
+            self.blocks.complete(operations[0]['block_num'])
+        return result
+
+    async def _write(self, worker: WorkerProcess, operations: list) -> list:
+        await self._run_in_executor(self._write_block, worker, operations)
+        if self.reversed_mode or not self.config.notification.send:
+            return []
+        routes = self.config.operation_routes
+        return [operation for operation in operations if routes[operation['type']].notification_event]
+
+    async def _notify(self, worker: WorkerProcess, operations: list):
+        for operation in operations:
+            await self._run_in_executor(worker._send_notification, operation)
+
+    @staticmethod
+    async def _close(queue: asyncio.Queue, number: int):
+        for _ in range(number):
+            await queue.put(None)
+
+    async def run(self):
+        options = self.config.asyncio
+        self._loop = asyncio.get_event_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2 + options.filter_concurrency + options.write_concurrency + options.notification_concurrency
+        )
+        self.mongo = resources.mongo()
+        self.settings = Settings(self.mongo)
+        self._saved_block = self._get_last_block()
+        self.blocks = BlockSequence(self._saved_block, self.reversed_mode)
+        self._finished = asyncio.Event()
+        checkpoint_stage = asyncio.ensure_future(self._save_checkpoints())
+
+        fetched = asyncio.Queue(maxsize=options.queue_size)
+        filtered = asyncio.Queue(maxsize=options.queue_size)
+        written = asyncio.Queue(maxsize=options.queue_size)
+
+        fetch_stage = self._run_in_executor(self._fetch, fetched)
+        filter_stage = asyncio.ensure_future(self._run_stage(
+            'filter', options.filter_concurrency, self._make_scraper, self._filter, fetched, filtered))
+        write_stage = asyncio.ensure_future(self._run_stage(
+            'write', options.write_concurrency, self._make_writer, self._write, filtered, written))
+        notification_stage = asyncio.ensure_future(self._run_stage(
+            'notification', options.notification_concurrency, self._make_worker, self._notify, written))
+
+        await fetch_stage
+        await self._close(fetched, options.filter_concurrency)
+        await filter_stage
+        await self._close(filtered, options.write_concurrency)
+        await write_stage
+        for worker in self.writers:
+            await self._run_in_executor(self._finish_writer, worker)
+        await self._close(written, options.notification_concurrency)
+        await notification_stage
+        self._finished.set()
+        await checkpoint_stage
+        self._executor.shutdown()
+        logger.info('%s pipeline is finished.', self.name)
+
+
+def run_pipelines(config: Config):
+    if config.metrics.port:
+        # All stages run in this process, so metrics are served without Redis
+        metrics.configure(None)
+        MetricsServer(metrics.snapshot, config.metrics.host, config.metrics.port).start()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.gather(
+        AsyncPipeline(config, reversed_mode=False).run(),
+        AsyncPipeline(config, reversed_mode=True).run(),
+    ))
@@ -0,0 +1,64 @@
+import logging
+import time
+
+from pymongo.errors import ConnectionFailure
+from steepcommon.conf import APP_COLLECTIONS
+from steepcommon.mongo.storage import MongoStorage
+from steepcommon.utils import get_apps_from_json_metadata, retry
+
+logger = logging.getLogger(__name__)
+
+
+def get_author(op_data: dict) -> str:
+    return op_data.get('author') or op_data.get('comment_author') or ''
+
+
+class AuthorPrefilter(object):
+    """Rejects post operations which can't belong to any app without database queries.
+
+    An operation may belong to an app only if it is a comment with app in its metadata,
+    or its author or parent author has posts or comments in collections of apps.
+    Authors are loaded from database every `reload_interval` seconds, authors of accepted
+    comments are added at once, because workers are about to write their posts.
+    """
+
+    def __init__(self, mongo: MongoStorage, reload_interval: float = 600):
+        self.mongo = mongo
+        self.reload_interval = reload_interval
+        self.authors = set()
+        self.rejected = 0
+        self._loaded_at = None
+
+    def load(self):
+        authors = set()
+        for collections in APP_COLLECTIONS.values():
+            for collection_name in collections.values():
+                collection = getattr(self.mongo, collection_name, None)
+                if not collection:
+                    continue
+                res = retry(collection.distinct, 5, ConnectionFailure)('author')
+                if isinstance(res, Exception):
+                    logger.error('Failed to load authors from "%s": %s', collection_name, res)
+                    # Keep the previous set and try again later
+                    return
+                authors.update(res)
+        self.authors = authors
+        self._loaded_at = time.monotonic()
+        logger.info('%s authors of apps are loaded.', len(authors))
+
+    def add(self, author: str):
+        self.authors.add(author)
+
+    def accepts(self, op_type: str, op_data: dict) -> bool:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval:
+            self.load()
+        if self._loaded_at is None:
+            # Authors are unknown, so every operation is checked in database
+            return True
+
+        if get_author(op_data) in self.authors or op_data.get('parent_author') in self.authors:
+            return True
+        if op_type == 'comment' and get_apps_from_json_metadata(op_data.get('json_metadata')):
+            return True
+        self.rejected += 1
+        return False
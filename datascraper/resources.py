@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from redis import ConnectionPool, Redis
+from requests.adapters import HTTPAdapter
+from steepcommon.mongo.storage import MongoStorage
+
+from datascraper.metrics import series
+
+logger = logging.getLogger(__name__)
+
+# Used until the process is configured, e.g. by benchmarks
+DEFAULT_POOL_SIZE = 10
+
+
+def with_uri_options(uri: str, **options) -> str:
+    """Adds options to query of connection string, options which are set in the string are kept."""
+    parts = urlsplit(uri)
+    query = dict(parse_qsl(parts.query))
+    for key, value in options.items():
+        query.setdefault(key, str(value))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class ProcessResources(object):
+    """Clients of Mongo, Redis and HTTP APIs shared by everything that runs in one process.
+
+    Clients are created on first use. When a process which has created clients is forked, the child
+    drops inherited clients without closing them and creates its own, so sockets are never shared
+    between processes. Every Redis database has a connection pool of `redis_pool_size` connections,
+    Mongo client keeps up to `mongo_pool_size` connections and HTTP sessions keep up to
+    `http_pool_size` connections per host.
+    """
+
+    def __init__(self):
+        self.config = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._mongo = None
+        self._redis = {}
+        self._sessions = {}
+
+    def configure(self, config):
+        """Is called in every process before clients are used, clients which are already created are kept."""
+        self.config = config
+
+    def _pool_size(self, name: str) -> int:
+        if self.config is None:
+            return DEFAULT_POOL_SIZE
+        return getattr(self.config.connections, name)
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+        logger.debug('Clients inherited from process %s are dropped in process %s.', self._pid, os.getpid())
+        # The lock could be held by a thread of the parent, which doesn't exist in this process
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._mongo = None
+        self._redis = {}
+        self._sessions = {}
+
+    def mongo(self) -> MongoStorage:
+        self._check_pid()
+        with self._lock:
+            if self._mongo is None:
+                uri = with_uri_options(self.config.mongo_uri, maxPoolSize=self._pool_size('mongo_pool_size'))
+                self._mongo = MongoStorage(uri)
+            return self._mongo
+
+    def redis(self, db_name: str) -> Redis:
+        """Returns client of Redis database by its name in config, e.g. "forward_db"."""
+        self._check_pid()
+        with self._lock:
+            if db_name not in self._redis:
+                pool = ConnectionPool(host=self.config.redis_host, port=self.config.redis_port,
+                                      db=self.config.redis_databases[db_name],
+                                      max_connections=self._pool_size('redis_pool_size'))
+                self._redis[db_name] = Redis(connection_pool=pool)
+            return self._redis[db_name]
+
+    def session(self, name: str, headers: dict = None, pool_size: int = None) -> requests.Session:
+        """Returns HTTP session by its name, `headers` and `pool_size` are used only when it's created."""
+        self._check_pid()
+        with self._lock:
+            if name not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=max(pool_size or 0, self._pool_size('http_pool_size')))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update(headers or {})
+                self._sessions[name] = session
+            return self._sessions[name]
+
+    def stats(self) -> dict:
+        self._check_pid()
+        with self._lock:
+            stats = {'mongo': {'connected': self._mongo is not None}, 'redis': {}, 'http': {}}
+            for db_name, client in self._redis.items():
+                pool = client.connection_pool
+                stats['redis'][db_name] = {
+                    'in_use': len(pool._in_use_connections),
+                    'idle': len(pool._available_connections),
+                    'max': pool.max_connections,
+                }
+            for name, session in self._sessions.items():
+                adapter = session.get_adapter('http://')
+                stats['http'][name] = {'hosts': len(adapter.poolmanager.pools), 'max': adapter._pool_maxsize}
+            return stats
+
+    def connection_series(self) -> dict:
+        """Returns numbers of Redis connections of this process, to be passed to `Metrics.track`."""
+        values = {}
+        for db_name, pool_stats in self.stats()['redis'].items():
+            for state in ('in_use', 'idle'):
+                values[series('datascraper_redis_connections', db=db_name, state=state)] = pool_stats[state]
+        return values
+
+
+resources = ProcessResources()
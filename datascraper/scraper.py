@@ -1,15 +1,26 @@
 import logging
 import multiprocessing
-import pickle
-from typing import Optional
+import queue
+import sys
+import time
+from typing import Callable, Optional
 
 from redis import Redis
 from steepcommon.lib import Steem
 from steepcommon.lib.blockchain import Blockchain
 from steepcommon.lib.instance import set_shared_steemd_instance
-from steepcommon.mongo.storage import MongoStorage, Settings
+from steepcommon.mongo.storage import Settings
 
+from datascraper.backfill import BackfillRanges
+from datascraper.cache import OwnershipCache
+from datascraper.checkpoint import dispatch_block
+from datascraper.codec import QueueCodec
 from datascraper.config import Config
+from datascraper.fetcher import BlockFetcher
+from datascraper.index import ADD, IdentifierIndex
+from datascraper.metrics import cache_series, direction, metrics
+from datascraper.prefilter import AuthorPrefilter
+from datascraper.resources import resources
 from datascraper.utils import Operation, get_apps_for_operation
 
 logger = logging.getLogger(__name__)
@@ -26,42 +37,106 @@ class ScrapeProcess(multiprocessing.Process):
         self.redis_obj = redis_obj
         self.redis_list_name = redis_list_name
         self.reversed_mode = reversed_mode
-        self.steem = Steem(nodes=self.config.nodes)
+        self.steem = None
+        self.node = None
+        self._connect()
         self.mongo = None
+        self.author_prefilter = None
+        self.identifier_index = None
+        self.ownership_cache = OwnershipCache(self.config.ownership_cache.max_size, self.config.ownership_cache.ttl,
+                                              self.config.ownership_cache.negative_ttl)
+        self.codec = QueueCodec(self.config.queue_codec.serializer, self.config.queue_codec.compression,
+                                self.config.queue_codec.accept_pickle)
+        self.watermarks = self.config.backpressure.get(redis_list_name)
+        self.stalled_time = 0
+
+    def _connect(self):
+        """Connects to nodes from the healthiest one."""
+        nodes = self.config.node_pool.ranked()
+        self.node = nodes[0]
+        self.steem = Steem(nodes=nodes)
         set_shared_steemd_instance(self.steem)
 
     def _check_operation(self, operation):
-        op_type = operation['type']
-        if op_type in self.config.operation_types:
-            if op_type in self.config.transfer_operations:
-                return True
-            if op_type in self.config.delegate_operations:
+        route = self.config.operation_routes.get(operation['type'])
+        if route is None:
+            return False
+        if route.transfer or route.delegate:
+            return True
+        operation = Operation(operation)
+        if route.update:
+            return operation.check_account_auths()
+        if route.post:
+            if self.identifier_index is not None:
+                self.identifier_index.refresh()
+            if self.author_prefilter is not None and not self.author_prefilter.accepts(operation['type'], operation):
+                return False
+            apps_list = get_apps_for_operation(operation,
+                                               self.mongo,
+                                               self.reversed_mode,
+                                               operation.get_identifier(),
+                                               operation.get_parent_identifier(),
+                                               cache=self.ownership_cache,
+                                               index=self.identifier_index)
+            if apps_list:
+                if self.author_prefilter is not None and operation['type'] == 'comment':
+                    self.author_prefilter.add(operation['author'])
                 return True
-            if op_type in self.config.update_operations:
-                return Operation(operation).check_account_auths()
-            if op_type in self.config.post_operations:
-                identifier = Operation(operation).get_identifier()
-                parent_identifier = Operation(operation).get_parent_identifier()
-                apps_list = get_apps_for_operation(Operation(operation),
-                                                   self.mongo,
-                                                   self.reversed_mode,
-                                                   identifier, parent_identifier)
-                if apps_list:
-                    return True
         return False
 
-    def _scrape_operations(self, last_block: int):
-        # settings = Settings(self.mongo)
-        blockchain = Blockchain(steemd_instance=self.steem, mode='irreversible')
-        if self.reversed_mode:
+    def _on_identifier_update(self, update: list):
+        if update[0] != ADD:
+            return
+        # Post is written by worker, so "not an app post" cached before is stale
+        self.ownership_cache.invalidate(update[-1])
+        if self.author_prefilter is not None:
+            # Authors of comments written by workers, e.g. replies of main posts, are known at once
+            self.author_prefilter.add(update[-1].lstrip('@').split('/', 1)[0])
+
+    def _push_block(self, block: list):
+        length = dispatch_block(self.redis_obj, self.redis_list_name, block[0]['block_num'], self.codec.encode(block))
+        metrics.inc('datascraper_blocks_total', stage='scraped', direction=direction(self.reversed_mode))
+        metrics.inc('datascraper_operations_total', len(block), stage='scraped',
+                    direction=direction(self.reversed_mode))
+        if self.watermarks and length >= self.watermarks.high:
+            self._wait_for_workers(length)
+
+    def _wait_for_workers(self, length: int):
+        """Pauses scraping until workers drain the queue to the low watermark."""
+        logger.info('Queue "%s" has reached %s blocks, waiting for workers.', self.redis_list_name, length)
+        started = time.monotonic()
+        while length > self.watermarks.low:
+            time.sleep(self.watermarks.polling_freq)
+            length = self.redis_obj.llen(self.redis_list_name)
+        stalled = time.monotonic() - started
+        self.stalled_time += stalled
+        logger.info('Queue "%s" is drained to %s blocks, scraper was stalled for %.1fs (%.1fs in total).',
+                    self.redis_list_name, length, stalled, self.stalled_time)
+
+    def _get_history(self, blockchain: Blockchain, last_block: int, end_block: int = 1):
+        if self.config.fetcher.window_size:
+            fetcher = BlockFetcher(self.config.nodes,
+                                   window_size=self.config.fetcher.window_size,
+                                   batch_size=self.config.fetcher.batch_size,
+                                   pool=self.config.node_pool,
+                                   probe_interval=self.config.fetcher.probe_interval,
+                                   op_types=self.config.operation_routes)
+            history = fetcher.history(last_block, end_block if self.reversed_mode else None)
+        elif self.reversed_mode:
             history = blockchain.history(
                 start_block=last_block,
-                end_block=1
+                end_block=end_block
             )
         else:
             history = blockchain.history(
                 start_block=last_block
             )
+        return history
+
+    def _scrape_operations(self, last_block: int, end_block: int = 1):
+        # settings = Settings(self.mongo)
+        blockchain = Blockchain(steemd_instance=self.steem, mode='irreversible')
+        history = self._get_history(blockchain, last_block, end_block)
 
         mode_name = 'reversed' if self.reversed_mode else 'normal'
         logger.info('Fetching operations in {mode} mode, starting with block {block}...'.format(
@@ -71,39 +146,53 @@ class ScrapeProcess(multiprocessing.Process):
 
         block = []
         block_number = last_block
+        filter_time = 0
 
         for operation in history:
+            started = time.perf_counter()
             if operation['block_num'] == block_number:
-                if operation['type'] in self.config.operation_types:
-                    if self._check_operation(operation):
-                        block.append(operation)
+                if self._check_operation(operation):
+                    block.append(operation)
+                filter_time += time.perf_counter() - started
                 continue
             else:
+                metrics.observe('datascraper_stage_seconds', filter_time, stage='filter',
+                                direction=direction(self.reversed_mode))
                 if block:
-                    self.redis_obj.lpush(self.redis_list_name, pickle.dumps(block))
+                    self._push_block(block)
 
                 block.clear()
                 block_number = operation['block_num']
 
+                started = time.perf_counter()
                 if self._check_operation(operation):
                     block.append(operation)
+                filter_time = time.perf_counter() - started
 
                 if operation['block_num'] != last_block:
                     last_block = operation['block_num']
 
                     if last_block % 100 == 0:
-                        logger.info('mode: %s - #%s: (%s)', mode_name, last_block, blockchain.steem.hostname)
+                        logger.info('mode: %s - #%s: (%s), stalled by workers: %.1fs',
+                                    mode_name, last_block, blockchain.steem.hostname, self.stalled_time)
+                        logger.debug('Ownership cache: %s', self.ownership_cache.stats())
+
+        if block:
+            self._push_block(block)
 
         logger.info('Finished to scrape data in mode "%s".', mode_name)
 
     def _run_scraper(self):
         settings = Settings(self.mongo)
 
-        last_failed_block = -1
-
         def get_last_block():
             return settings.last_reversed_block() if self.reversed_mode else settings.last_block()
 
+        self._scrape_with_attempts(get_last_block)
+
+    def _scrape_with_attempts(self, get_last_block: Callable[[], int], end_block: int = 1) -> bool:
+        last_failed_block = -1
+
         for attempt in range(self.config.max_attempts):
             last_block = get_last_block()
             if attempt > 0:
@@ -112,8 +201,8 @@ class ScrapeProcess(multiprocessing.Process):
                 last_block = (last_block - 1) if self.reversed_mode else (last_block + 1)
                 logger.info('%s attempt. Skip 1 block.', attempt)
             try:
-                self._scrape_operations(last_block)
-                break
+                self._scrape_operations(last_block, end_block)
+                return True
             except Exception as e:
                 logger.exception(
                     'Failed to scraper operations. '
@@ -122,13 +211,80 @@ class ScrapeProcess(multiprocessing.Process):
                     e
                 )
                 last_failed_block = get_last_block()
+                metrics.inc('datascraper_retries_total', stage='scrape', direction=direction(self.reversed_mode))
+                if not self.config.fetcher.window_size:
+                    # Block fetcher reports failed nodes by itself
+                    self.config.node_pool.record_failure(self.node)
+                    self._connect()
         else:
             logger.error(
                 'The maximum number of attempts is reached: %s. '
                 'Please ensure that specified nodes is working and re-run scraper.',
                 self.config.max_attempts
             )
+        return False
 
     def run(self):
-        self.mongo = MongoStorage(self.config.mongo_uri)
+        resources.configure(self.config)
+        # Clients are created in this process unless they are passed, e.g. by benchmarks
+        if self.redis_obj is None:
+            self.redis_obj = resources.redis(self.redis_list_name)
+        self.mongo = resources.mongo()
+        if self.config.prefilter.authors:
+            self.author_prefilter = AuthorPrefilter(self.mongo, self.config.prefilter.reload_interval)
+        if self.config.identifier_index.enabled:
+            self.identifier_index = IdentifierIndex(self.mongo, self.redis_obj,
+                                                    self.config.identifier_index.reload_interval)
+            self.identifier_index.listeners.append(self._on_identifier_update)
+        metrics.configure(self.redis_obj, self.config.metrics.flush_interval)
+        metrics.track(lambda: cache_series('ownership', self.ownership_cache))
+        metrics.track(resources.connection_series)
         self._run_scraper()
+
+
+class RangeScrapeProcess(ScrapeProcess):
+    """Backward scraper which takes block ranges from coordinator queue until there are no ranges left."""
+
+    def __init__(self, name: str, config: Config, redis_list_name: str,
+                 redis_obj: Redis, ranges_queue: multiprocessing.Queue,
+                 daemon: Optional[bool] = None):
+        super(RangeScrapeProcess, self).__init__(name, config, redis_list_name, redis_obj,
+                                                 reversed_mode=True, daemon=daemon)
+        self.ranges_queue = ranges_queue
+        # Range being scraped, shared with supervisor to return it to the queue if the process crashes
+        self.current_range = multiprocessing.Array('c', 64)
+
+    def _run_scraper(self):
+        ranges = BackfillRanges(self.mongo)
+
+        while True:
+            try:
+                range_id = self.ranges_queue.get(timeout=1)
+            except queue.Empty:
+                break
+
+            block_range = ranges.get(range_id)
+            if not block_range or BackfillRanges.is_finished(block_range):
+                continue
+
+            logger.info('%s takes range %s-%s from block %s.', self.name,
+                        block_range['start'], block_range['end'], block_range['position'])
+            self.current_range.value = range_id.encode()
+
+            def get_last_block():
+                return ranges.get(range_id)['position']
+
+            if self._scrape_with_attempts(get_last_block, block_range['end']):
+                # Range is finished by block updater when workers have written its blocks
+                ranges.set_scraped(range_id)
+            else:
+                # Give this range to another scraper, non-zero exit code makes supervisor restart this one,
+                # so the range is scraped even if no other scraper is left
+                self.ranges_queue.put(range_id)
+                self.current_range.value = b''
+                logger.error('%s failed to scrape range %s-%s, it is returned to the queue.', self.name,
+                             block_range['start'], block_range['end'])
+                sys.exit(1)
+            self.current_range.value = b''
+
+        logger.info('%s has no more ranges to scrape.', self.name)
@@ -0,0 +1,151 @@
+import logging
+import os
+import signal
+import time
+from typing import Callable
+
+from datascraper.autoscaler import WorkerAutoscaler
+
+logger = logging.getLogger(__name__)
+
+ALWAYS = 'always'
+ON_FAILURE = 'on-failure'
+
+
+class Child(object):
+    """Process owned by supervisor. A new process object is made by `factory` for every start."""
+
+    def __init__(self, name: str, factory: Callable, restart: str = ALWAYS, on_exit: Callable = None,
+                 scraper: bool = False):
+        self.name = name
+        self.factory = factory
+        self.restart = restart
+        self.on_exit = on_exit
+        self.scraper = scraper
+        self.process = None
+        self.started_at = None
+        self.restart_at = None
+        self.crashes = 0
+        self.finished = False
+
+
+class Supervisor(object):
+    """Owns all processes of datascraper, restarts the exited ones and stops them on SIGTERM or SIGINT.
+
+    A crashed process is restarted after a delay which doubles with every crash in a row, starting with
+    `backoff` seconds and up to `max_backoff`. A process which has worked for `stable_time` is considered
+    healthy again. Workers are managed by the autoscaler, which respawns crashed workers on its next check.
+
+    Children inherit the signal handler and ignore SIGTERM and SIGINT sent to the whole process group,
+    e.g. by Ctrl+C, supervisor stops them itself. Workers turn SIGTERM into their stop event.
+    On shutdown scrapers are stopped first, then workers drain the queues for up to `shutdown_timeout`
+    seconds and write their blocks, then the rest of processes are stopped after `final_delay` seconds,
+    so the block updater can save the last checkpoint.
+    """
+
+    def __init__(self, autoscaler: WorkerAutoscaler, backoff: float = 1, max_backoff: float = 60,
+                 stable_time: float = 60, shutdown_timeout: float = 300, final_delay: float = 0,
+                 polling_freq: float = 1):
+        self.autoscaler = autoscaler
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.shutdown_timeout = shutdown_timeout
+        self.final_delay = final_delay
+        self.polling_freq = polling_freq
+        self.children = []
+        self._stopping = False
+        self._pid = None
+
+    def add(self, name: str, factory: Callable, restart: str = ALWAYS, on_exit: Callable = None,
+            scraper: bool = False):
+        self.children.append(Child(name, factory, restart, on_exit, scraper))
+
+    def _start(self, child: Child):
+        child.process = child.factory()
+        child.process.start()
+        child.started_at = time.monotonic()
+        child.restart_at = None
+
+    def _check(self, child: Child, now: float):
+        if child.finished or child.process.is_alive():
+            return
+
+        if child.restart_at is None:
+            exitcode = child.process.exitcode
+            if child.on_exit:
+                child.on_exit(child.process)
+            if exitcode == 0 and child.restart == ON_FAILURE:
+                logger.info('%s has finished.', child.name)
+                child.finished = True
+                return
+            if now - child.started_at >= self.stable_time:
+                child.crashes = 0
+            delay = min(self.max_backoff, self.backoff * 2 ** child.crashes)
+            child.crashes += 1
+            child.restart_at = now + delay
+            logger.error('%s has exited with code %s, restart in %.1fs.', child.name, exitcode, delay)
+        elif now >= child.restart_at:
+            logger.info('Restart %s.', child.name)
+            self._start(child)
+
+    def _handle_signal(self, signum, frame):
+        if os.getpid() != self._pid:
+            # Processes started after the handler was set inherit it, they are stopped by supervisor in order
+            return
+        logger.info('Signal %s is received, shutting down.', signum)
+        self._stopping = True
+
+    def run(self):
+        self._pid = os.getpid()
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        for child in self.children:
+            self._start(child)
+
+        scaled_at = None
+        while not self._stopping:
+            now = time.monotonic()
+            for child in self.children:
+                self._check(child, now)
+            if scaled_at is None or now - scaled_at >= self.autoscaler.interval:
+                self.autoscaler.step()
+                scaled_at = now
+            time.sleep(self.polling_freq)
+
+        self.shutdown()
+
+    @staticmethod
+    def _stop(children: list):
+        for child in children:
+            if child.process.is_alive():
+                # SIGTERM is ignored by children
+                child.process.kill()
+        for child in children:
+            child.process.join()
+
+    def _wait_for_queues(self):
+        deadline = time.monotonic() + self.shutdown_timeout
+        while time.monotonic() < deadline:
+            lengths = {pool.list_name: pool.redis_obj.llen(pool.list_name) for pool in self.autoscaler.pools}
+            if not any(lengths.values()):
+                return
+            logger.info('Waiting for workers to drain queues: %s', lengths)
+            self.autoscaler.step()
+            time.sleep(min(self.autoscaler.interval, max(0, deadline - time.monotonic())))
+        logger.warning('Queues are not drained within %ss.', self.shutdown_timeout)
+
+    def shutdown(self):
+        scrapers = [child for child in self.children if child.scraper and not child.finished]
+        self._stop(scrapers)
+        logger.info('Scrapers are stopped.')
+
+        self._wait_for_queues()
+        for pool in self.autoscaler.pools:
+            pool.stop_all(self.shutdown_timeout)
+        logger.info('Workers are stopped.')
+
+        time.sleep(self.final_delay)
+        self._stop([child for child in self.children if not child.scraper and not child.finished])
+        logger.info('All processes are stopped.')
@@ -3,11 +3,14 @@ import logging
 from pymongo.errors import ConnectionFailure
 from steepcommon.conf import APP_COLLECTIONS
 from steepcommon.enums import CollectionType
+from steepcommon.lib.post import Post
 from steepcommon.mongo import consts
 from steepcommon.mongo.storage import MongoStorage
 from steepcommon.utils import get_apps_from_json_metadata, retry
 
+from datascraper.cache import OwnershipCache, PostIndex, PostInfo
 from datascraper.config import AUTHORS_OP_UPDATE
+from datascraper.index import IdentifierIndex
 
 logger = logging.getLogger(__name__)
 
@@ -39,49 +42,137 @@ class Operation(dict):
         return False
 
 
+def _find_apps(mongo: MongoStorage, collection_type: CollectionType, query: dict) -> set:
+    apps = set()
+    for app, collections in APP_COLLECTIONS.items():
+        collection = getattr(mongo, collections[collection_type], None)
+        if not collection:
+            continue
+        res = retry(collection.find_one, 5, ConnectionFailure)(query)
+        if isinstance(res, Exception):
+            logger.error('Failed to get data from database: %s', res)
+            # Don't cache result of failed lookups
+            return None
+        elif res:
+            apps.add(app)
+    return apps
+
+
+def get_owner_apps(mongo: MongoStorage, collection_type: CollectionType, identifier: str,
+                   cache: OwnershipCache = None, index: IdentifierIndex = None) -> set:
+    """Returns set of apps which have `identifier` in their collections of `collection_type`."""
+    if index is not None and index.is_ready:
+        return index.get_apps(collection_type, identifier)
+
+    if cache is not None:
+        apps = cache.get_apps(collection_type, identifier)
+        if apps is not None:
+            return apps
+
+    query = {'identifier': identifier}
+    if collection_type == CollectionType.posts:
+        query[consts.DELETED_FIELD] = {'$ne': True}
+
+    apps = _find_apps(mongo, collection_type, query)
+    if apps is None:
+        return set()
+    if cache is not None:
+        cache.set_apps(collection_type, identifier, apps)
+    return apps
+
+
 def get_apps_for_operation(operation: Operation,
                            mongo: MongoStorage,
                            reversed_mode: bool,
                            identifier: str = None,
-                           parent_identifier: str = None) -> set:
+                           parent_identifier: str = None,
+                           cache: OwnershipCache = None,
+                           index: IdentifierIndex = None) -> set:
     apps = get_apps_from_json_metadata(operation.get('json_metadata'))
 
-    for app, collections in APP_COLLECTIONS.items():
-        posts_name = collections[CollectionType.posts]
-        comments_name = collections[CollectionType.comments]
-
-        mongo_posts = getattr(mongo, posts_name, None)
-        if mongo_posts:
-            if identifier:
-                res = retry(mongo_posts.find_one, 5, ConnectionFailure)(
-                    {'identifier': identifier, consts.DELETED_FIELD: {'$ne': True}}
-                )
-                if isinstance(res, Exception):
-                    logger.error('Failed to get data from database: %s', res)
-                elif res:
-                    if not reversed_mode:
-                        apps.add(app)
-                    # If scraper works in reverse mode that we don't need to update already existing posts
-                    continue
-            if parent_identifier:
-                res = retry(mongo_posts.find_one, 5, ConnectionFailure)(
-                    {'identifier': parent_identifier, consts.DELETED_FIELD: {'$ne': True}}
-                )
-                if isinstance(res, Exception):
-                    logger.error('Failed to get data from database: %s', res)
-                elif res:
-                    if not reversed_mode:
-                        apps.add(app)
-                    continue
-
-                mongo_comments = getattr(mongo, comments_name, None)
-                if mongo_comments:
-                    res = retry(mongo_comments.find_one, 5, ConnectionFailure)(
-                        {'identifier': parent_identifier}
-                    )
-                    if isinstance(res, Exception):
-                        logger.error('Failed to get data from database: %s', res)
-                    elif res:
-                        apps.add(app)
-                        continue
+    posts_owners = get_owner_apps(mongo, CollectionType.posts, identifier, cache, index) if identifier else set()
+    comments_owners = None
+    parent_posts_owners = None
+    parent_comments_owners = None
+
+    for app in APP_COLLECTIONS:
+        if app in posts_owners:
+            if not reversed_mode:
+                apps.add(app)
+            # If scraper works in reverse mode that we don't need to update already existing posts
+            continue
+        if identifier and not parent_identifier and operation.get('type') != 'comment':
+            # Votes and rewards of comments name only the comment, which is updated by itself
+            if comments_owners is None:
+                comments_owners = get_owner_apps(mongo, CollectionType.comments, identifier, cache, index)
+            if app in comments_owners:
+                if not reversed_mode:
+                    apps.add(app)
+                continue
+        if parent_identifier:
+            if parent_posts_owners is None:
+                parent_posts_owners = get_owner_apps(mongo, CollectionType.posts, parent_identifier, cache, index)
+            if app in parent_posts_owners:
+                if not reversed_mode:
+                    apps.add(app)
+                continue
+
+            if parent_comments_owners is None:
+                parent_comments_owners = get_owner_apps(mongo, CollectionType.comments, parent_identifier,
+                                                        cache, index)
+            if app in parent_comments_owners:
+                apps.add(app)
+
+    if apps and identifier and operation.get('type') == 'comment':
+        # Post will be written to database by worker, so the next operations
+        # for this identifier shouldn't rely on the negative result cached before
+        collection_type = CollectionType.comments if parent_identifier else CollectionType.posts
+        if cache is not None:
+            cache.add_apps(collection_type, identifier, apps)
+        if index is not None:
+            index.add(collection_type, identifier, apps)
     return apps
+
+
+def _find_post_info(mongo: MongoStorage, identifier: str, index: PostIndex):
+    projection = {'root_author': 1, 'root_permlink': 1, 'parent_author': 1}
+    for collections in APP_COLLECTIONS.values():
+        for collection_type in (CollectionType.posts, CollectionType.comments):
+            collection = getattr(mongo, collections[collection_type], None)
+            if not collection:
+                continue
+            res = retry(collection.find_one, 5, ConnectionFailure)({'identifier': identifier}, projection)
+            if isinstance(res, Exception):
+                logger.error('Failed to get data from database: %s', res)
+                return None
+            if not res:
+                continue
+            if collection_type == CollectionType.posts:
+                info = PostInfo(False, identifier)
+                index.set(identifier, info)
+                return info
+            index.add_post(identifier, res)
+            return index.get(identifier)
+    return None
+
+
+def get_post_info(identifier: str, mongo: MongoStorage = None, index: PostIndex = None) -> PostInfo:
+    """Returns whether `identifier` is a comment and the identifier of its main post.
+
+    Looks up the index first, then posts and comments in database, and only then fetches the post from blockchain.
+    """
+    if index is None:
+        index = PostIndex(max_size=1)
+    info = index.get(identifier)
+    if info is not None:
+        return info
+
+    if mongo is not None:
+        info = _find_post_info(mongo, identifier, index)
+        if info is not None:
+            return info
+
+    post = Post(identifier)
+    info = PostInfo(post.is_comment(), post.root_identifier)
+    index.set(identifier, info)
+    return info
@@ -1,16 +1,15 @@
-import json
 import logging
 import multiprocessing
-import pickle
+import signal
 import time
+from collections import OrderedDict
 from typing import Union
 from datetime import datetime, timedelta
 
-import requests
 from cerberus import Validator
-from pymongo.errors import DuplicateKeyError, ConnectionFailure
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import ConnectionFailure
 from redis import Redis
-from requests import RequestException
 from steepcommon.conf import APP_COLLECTIONS
 from steepcommon.enums import CollectionType, Application
 from steepcommon.lib import Steem
@@ -18,22 +17,31 @@ from steepcommon.lib.amount import Amount
 from steepcommon.lib.instance import set_shared_steemd_instance
 from steepcommon.lib.post import Post
 from steepcommon.libbase.exceptions import PostDoesNotExist
-from steepcommon.mongo.storage import MongoStorage
 from steepcommon.mongo.wrappers import mark_post_as_deleted
 from steepcommon.utils import has_images, retry
 
-import datascraper.notification
+from datascraper.bulk import BulkWriter
+from datascraper.cache import LRUCache, OwnershipCache, PostIndex
+from datascraper.checkpoint import complete_blocks, dead_letter_block, requeue_claimed_blocks
+from datascraper.codec import CodecError, QueueCodec
 from datascraper.config import Config
-from datascraper.schema import POST_SCHEMA
+from datascraper.dispatcher import NotificationDispatcher
+from datascraper.index import IdentifierIndex, publish_updates
+from datascraper.metrics import cache_series, direction, metrics
+from datascraper.resources import resources
+from datascraper.schema import POST_SCHEMA, FastValidator
 from datascraper.utils import Operation, get_apps_for_operation
 
 logger = logging.getLogger(__name__)
 
+# Time of the last update of all replies of main post
+REPLIES_REFRESHED_FIELD = 'replies_refreshed_at'
+
 
 class WorkerProcess(multiprocessing.Process):
     def __init__(self, name: str, redis_obj: Redis, redis_result_obj: Redis,
                  redis_list_name: str, config: Config, reversed_mode: bool,
-                 daemon: bool, polling_freq: Union[int, float]):
+                 daemon: bool, polling_freq: Union[int, float], stop_event: multiprocessing.Event = None):
         multiprocessing.Process.__init__(self)
         self.name = name
         self.redis_obj = redis_obj
@@ -43,14 +51,41 @@ class WorkerProcess(multiprocessing.Process):
         self.reversed_mode = reversed_mode
         self.daemon = daemon
         self.polling_freq = polling_freq
-        self.steem = Steem(nodes=self.config.nodes)
+        # When it is set, worker writes processed blocks and exits
+        self.stop_event = stop_event
+        # Set by SIGTERM, the event isn't set from signal handler, because its lock may be held by the same thread
+        self._signalled = False
+        self.steem = Steem(nodes=self.config.node_pool.ranked())
         self.mongo = None
+        self.bulk_writer = None
+        self.processed_blocks = []
+        # Blocks which are written to database, but aren't reported as completed yet
+        self.written_blocks = []
+        # Number of the block being processed, scheduled updates keep the number of the block which scheduled them
+        self.block_seq = 0
+        self._acked_at = time.monotonic()
+        self.ownership_cache = OwnershipCache(self.config.ownership_cache.max_size, self.config.ownership_cache.ttl,
+                                              self.config.ownership_cache.negative_ttl)
+        self.post_cache = LRUCache(self.config.post_updates.cache_size, self.config.post_updates.cache_ttl)
+        self.scheduled_updates = OrderedDict()
+        self.replies_refreshed = LRUCache(self.config.post_updates.cache_size,
+                                          self.config.post_updates.reconcile_interval)
+        self.coalesced_updates = 0
+        # Updates of identifier index of scrapers, published when writes are sent to database
+        self.identifier_updates = []
+        self.handlers = self._compile_handlers()
+        self.post_index = PostIndex(self.config.notification.index_size, self.config.notification.index_ttl)
+        self.notifier = NotificationDispatcher(self.config.notification, self.post_index)
+        if self.config.post_validator == 'fast':
+            self.post_validator = FastValidator(POST_SCHEMA)
+        else:
+            self.post_validator = Validator(POST_SCHEMA, allow_unknown=True)
+        self.codec = QueueCodec(self.config.queue_codec.serializer, self.config.queue_codec.compression,
+                                self.config.queue_codec.accept_pickle)
         set_shared_steemd_instance(self.steem)
 
     def _insert_delegate_op(self, operation: Operation):
-        result = retry(self.mongo.Operations.insert_one, 5, (DuplicateKeyError, ConnectionFailure))(operation)
-        if isinstance(result, ConnectionFailure):
-            logger.error('Failed to insert operation: %s.', result)
+        self.bulk_writer.add('Operations', InsertOne(operation), 'insert operation')
 
     def _insert_curator(self, operation: Operation):
         amount = Amount(operation['amount'])
@@ -65,27 +100,101 @@ class WorkerProcess(multiprocessing.Process):
             'currency': amount.asset,
         }
 
-        result = retry(self.mongo.Curators.insert_one, 5, (DuplicateKeyError, ConnectionFailure))(data)
-        if isinstance(result, ConnectionFailure):
-            logger.error('Failed to insert operation: %s.', result)
+        self.bulk_writer.add('Curators', InsertOne(data), 'insert curator "%s"' % data['username'])
 
     def _insert_operation(self, operation: Operation):
-        result = retry(self.mongo.Operations.insert_one, 5, (DuplicateKeyError, ConnectionFailure))(operation)
-        if isinstance(result, ConnectionFailure):
-            logger.error('Failed to insert operation: %s.', result)
+        self.bulk_writer.add('Operations', InsertOne(operation), 'insert operation')
 
     def _get_post_from_blockchain(self, post_identifier: str) -> Post:
-        p = None
-        for i in range(5):
-            try:
-                p = Post(post_identifier)
-                break
-            except TypeError:
-                continue
+        p = self.post_cache.get(post_identifier)
+        if p is not None:
+            return p
+        with metrics.timer('datascraper_stage_seconds', stage='post_fetch', direction=direction(self.reversed_mode)):
+            for i in range(5):
+                try:
+                    p = Post(post_identifier)
+                    break
+                except TypeError:
+                    metrics.inc('datascraper_retries_total', stage='post_fetch',
+                                direction=direction(self.reversed_mode))
+                    continue
         if not p:
             raise PostDoesNotExist()
+        self.post_cache.set(post_identifier, p)
         return p
 
+    def _needs_replies_refresh(self, posts_collection: str, post_identifier: str) -> bool:
+        """Checks whether all replies of main post should be updated: on the first ingest of the post
+        and when its last reconciliation is older than `reconcile_interval`."""
+        if not self.config.post_updates.incremental_replies:
+            return True
+        if self.replies_refreshed.get((posts_collection, post_identifier)) is not None:
+            return False
+
+        post = retry(getattr(self.mongo, posts_collection).find_one, 5, ConnectionFailure)(
+            {'identifier': post_identifier}, {REPLIES_REFRESHED_FIELD: 1}
+        )
+        if isinstance(post, Exception):
+            logger.error('Failed to get data from database: %s', post)
+            return True
+
+        refreshed_at = post.get(REPLIES_REFRESHED_FIELD) if post else None
+        if not refreshed_at:
+            return True
+        age = (datetime.utcnow() - refreshed_at).total_seconds()
+        if age >= self.config.post_updates.reconcile_interval:
+            return True
+        self.replies_refreshed.set((posts_collection, post_identifier), refreshed_at,
+                                   ttl=self.config.post_updates.reconcile_interval - age)
+        return False
+
+    def _schedule_update(self, post_identifier: str, apps: set):
+        """Collapses repeated updates of the same post within the coalescing window into one update.
+
+        The post is fetched and upserted when its window ends, so the latest state is written.
+        Blocks processed since the update was scheduled aren't reported as completed until it is done.
+        """
+        if not self.config.post_updates.coalesce_window:
+            self._upsert_comment(post_identifier, apps)
+            return
+
+        scheduled = self.scheduled_updates.get(post_identifier)
+        if scheduled:
+            scheduled[1].update(apps)
+            self.coalesced_updates += 1
+        else:
+            self.scheduled_updates[post_identifier] = (time.monotonic() + self.config.post_updates.coalesce_window,
+                                                       set(apps), self.block_seq)
+
+    def _run_scheduled_updates(self, force: bool = False):
+        now = time.monotonic()
+        while self.scheduled_updates:
+            post_identifier, (deadline, apps, _) = next(iter(self.scheduled_updates.items()))
+            if deadline > now and not force:
+                break
+            del self.scheduled_updates[post_identifier]
+            self._upsert_comment(post_identifier, apps)
+
+    def completed_seq(self) -> int:
+        """Returns the number of the last block whose updates are all written or about to be written.
+
+        Updates run in the order they are scheduled, so every block before the block which scheduled
+        the oldest waiting update is done. An update coalesced into a waiting one belongs to a later block.
+        """
+        if not self.scheduled_updates:
+            return self.block_seq
+        return next(iter(self.scheduled_updates.values()))[2] - 1
+
+    def _mark_owned(self, collection_type, post_identifier: str, app):
+        self.ownership_cache.add_apps(collection_type, post_identifier, {app})
+        if self.config.identifier_index.enabled:
+            self.identifier_updates.append(IdentifierIndex.add_update(collection_type, post_identifier, app))
+
+    def _mark_deleted(self, post_identifier: str):
+        self.ownership_cache.invalidate(post_identifier)
+        if self.config.identifier_index.enabled:
+            self.identifier_updates.append(IdentifierIndex.remove_update(post_identifier))
+
     def _upsert_comment(self, post_identifier: str, apps: set, post: Post = None, update_root=True):
         if not post or not isinstance(post, Post):
             try:
@@ -93,12 +202,16 @@ class WorkerProcess(multiprocessing.Process):
             except PostDoesNotExist:
                 post = {'identifier': post_identifier}
                 mark_post_as_deleted(post)
+                self._mark_deleted(post_identifier)
                 logger.info('Post marked as deleted: "%s"', post_identifier)
                 return
             except Exception as e:
                 logger.exception('Failed to get post from blockchain: %s', e)
                 return
 
+        if isinstance(post, Post):
+            self.post_index.add_post(post_identifier, post)
+
         logger.info('Update post "%s"', post_identifier)
         try:
             for app in apps:
@@ -109,7 +222,7 @@ class WorkerProcess(multiprocessing.Process):
                 if isinstance(post, Post):
                     if post.is_main_post():
 
-                        v = Validator(POST_SCHEMA, allow_unknown=True)
+                        v = self.post_validator
                         if not v.validate(post):
                             logger.error('Failed to validate post %s. List of errors: %s', post_identifier, v.errors)
                             return
@@ -118,16 +231,21 @@ class WorkerProcess(multiprocessing.Process):
 
                         if app == Application.steepshot and not has_images(validated_post.get('body', '')):
                             mark_post_as_deleted(validated_post)
+                            self._mark_deleted(post_identifier)
                             logger.info('Post marked as deleted: "%s"', post_identifier)
+                        else:
+                            self._mark_owned(CollectionType.posts, post_identifier, app)
 
-                        result = retry(getattr(self.mongo, collections[CollectionType.posts]).update_one, 5,
-                                       (DuplicateKeyError, ConnectionFailure))(
-                            {'identifier': post_identifier},
-                            {'$set': validated_post},
-                            upsert=True
+                        self.bulk_writer.add(
+                            collections[CollectionType.posts],
+                            UpdateOne({'identifier': post_identifier}, {'$set': validated_post}, upsert=True),
+                            'insert post: "%s"' % post_identifier
                         )
-                        if isinstance(result, Exception):
-                            logger.error('Failed to insert post: "%s". Error: %s', post_identifier, result)
+
+                        # Replies named in operations are updated by themselves,
+                        # the whole tree is updated only on first ingest and reconciliation
+                        if not self._needs_replies_refresh(collections[CollectionType.posts], post_identifier):
+                            continue
 
                         comments = retry(Post.get_all_replies, 5, Exception)(post)
                         if isinstance(comments, Exception):
@@ -136,26 +254,33 @@ class WorkerProcess(multiprocessing.Process):
                         else:
                             for comment in comments:
                                 self._upsert_comment(comment['identifier'], {app}, comment, update_root=False)
+                            refreshed_at = datetime.utcnow()
+                            self.bulk_writer.add(
+                                collections[CollectionType.posts],
+                                UpdateOne({'identifier': post_identifier},
+                                          {'$set': {REPLIES_REFRESHED_FIELD: refreshed_at}}),
+                                'save replies refresh time: "%s"' % post_identifier
+                            )
+                            self.replies_refreshed.set((collections[CollectionType.posts], post_identifier),
+                                                       refreshed_at)
                     else:
-                        result = retry(getattr(self.mongo, collections[CollectionType.comments]).update_one, 5,
-                                       (DuplicateKeyError, ConnectionFailure))(
-                            {'identifier': post_identifier},
-                            {'$set': post},
-                            upsert=True
+                        self.bulk_writer.add(
+                            collections[CollectionType.comments],
+                            UpdateOne({'identifier': post_identifier}, {'$set': post}, upsert=True),
+                            'insert comment: "%s"' % post_identifier
                         )
-                        if isinstance(result, Exception):
-                            logger.error('Failed to insert comment: "%s". Error: %s', post_identifier, result)
+                        self._mark_owned(CollectionType.comments, post_identifier, app)
 
                         if update_root:
-                            self._upsert_comment(post.root_identifier, {app})
+                            self._schedule_update(post.root_identifier, {app})
                 else:
                     for collection in collections.values():
-                        result = retry(getattr(self.mongo, collection).update_one, 5, (DuplicateKeyError, ConnectionFailure))(
-                            {'identifier': post_identifier},
-                            {'$set': post},
+                        self.bulk_writer.add(
+                            collection,
+                            UpdateOne({'identifier': post_identifier}, {'$set': post}),
+                            'mark post as deleted: "%s"' % post_identifier
                         )
-                        if isinstance(result, Exception):
-                            logger.error('Failed to mark post as deleted: "%s". Error: %s', post_identifier, result)
+                    self._mark_deleted(post_identifier)
         except AttributeError as e:
             logger.error('Failed to update post: "%s". Error: %s', post_identifier, e)
         except Exception as e:
@@ -168,61 +293,147 @@ class WorkerProcess(multiprocessing.Process):
         if operation['timestamp'] - datetime.utcnow() > timedelta(minutes=30):
             return
 
-        op_type = operation['type']
-        cls_name = self.config.notification.events.get(op_type)
-        if cls_name and hasattr(datascraper.notification, cls_name):
-            event = getattr(datascraper.notification, cls_name)
-            data = event(operation).json()
-            try:
-                resp = requests.post(self.config.notification.url,
-                                     data=json.dumps(data),
-                                     headers={
-                                         'Content-type': 'application/json',
-                                         'Authorization': 'Token %s' % self.config.notification.token
-                                     })
-                if 200 <= resp.status_code < 400:
-                    logger.debug('Notification sent: %s', data)
-                else:
-                    logger.warning('Failed to send notification: %s. Error: %s', data, resp.content)
-            except RequestException as error:
-                logger.error('Failed to retrieve data from api: {error}'.format(error=error))
+        self.notifier.submit(operation)
 
     def _parse_comment_update_operation(self, operation: Operation):
+        if operation['type'] == 'comment':
+            self.post_index.add_operation(operation)
         identifier = operation.get_identifier()
         parent_identifier = operation.get_parent_identifier()
         apps_list = get_apps_for_operation(operation, self.mongo, self.reversed_mode,
-                                           identifier, parent_identifier)
+                                           identifier, parent_identifier,
+                                           cache=self.ownership_cache)
         if apps_list:
-            self._upsert_comment(identifier, apps_list)
+            self._schedule_update(identifier, apps_list)
 
-    def _process_block(self, block_obj):
-        operations = pickle.loads(block_obj)
-        block_number = operations[0]['block_num']
+    def _insert_update_operation(self, operation: Operation):
+        if operation.check_account_auths():
+            self._insert_operation(operation)
+
+    def _insert_transfer_operation(self, operation: Operation):
+        self._insert_operation(operation)
+        if operation.get('to') in self.config.curators_payouts['accounts_for_transfer']:
+            self._insert_curator(operation)
+
+    def _compile_handlers(self) -> dict:
+        """Returns operation type -> tuple of handlers, built once from routes of config."""
+        handlers = {}
+        for op_type, route in self.config.operation_routes.items():
+            op_handlers = []
+            if route.post and not (self.reversed_mode and op_type in {'author_reward', 'vote'}):
+                op_handlers.append(self._parse_comment_update_operation)
+            if route.delegate:
+                op_handlers.append(self._insert_operation)
+            if route.update:
+                op_handlers.append(self._insert_update_operation)
+            if route.transfer:
+                op_handlers.append(self._insert_transfer_operation)
+            handlers[op_type] = tuple(op_handlers)
+        return handlers
+
+    def _process_operations(self, operations: list, send_notifications: bool = True):
+        self.block_seq += 1
+        send_notifications = send_notifications and not self.reversed_mode
         for operation in operations:
             op_type = operation['type']
-            if op_type in self.config.post_operations:
-                if not (self.reversed_mode and op_type in {'author_reward', 'vote'}):
-                    self._parse_comment_update_operation(Operation(operation))
-            if op_type in self.config.delegate_operations:
-                self._insert_operation(operation)
-            if op_type in self.config.update_operations:
-                if Operation(operation).check_account_auths():
-                    self._insert_operation(operation)
-            if op_type in self.config.transfer_operations:
-                self._insert_operation(operation)
-                if operation.get('to') in self.config.curators_payouts['accounts_for_transfer']:
-                    self._insert_curator(operation)
+            route = self.config.operation_routes.get(op_type)
+            if route is None:
+                continue
+            operation = Operation(operation)
+            for handler in self.handlers[op_type]:
+                handler(operation)
             # notifications
-            if not self.reversed_mode and op_type in self.config.notification.events:
+            if send_notifications and route.notification_event:
                 self._send_notification(operation)
 
-        self.redis_result_obj.lpush(self.redis_list_name, int(block_number))
+    def _process_block(self, block_obj):
+        try:
+            operations = self.codec.decode(block_obj)
+        except CodecError as e:
+            block_number = self.codec.block_num(block_obj)
+            dead_letter_block(self.redis_obj, self.redis_list_name, block_obj, block_number,
+                              self.processing_list_name if self.config.blocking_queue else None)
+            metrics.inc('datascraper_blocks_total', stage='dead_letter', direction=direction(self.reversed_mode))
+            if block_number is None:
+                logger.error('Failed to decode block from "%s", it is moved to dead-letter list, '
+                             'but its number is unknown, so checkpoint is held back: %s', self.redis_list_name, e)
+            else:
+                logger.error('Failed to decode block %s from "%s", it is moved to dead-letter list '
+                             'and should be scraped again: %s', block_number, self.redis_list_name, e)
+            return
+        block_number = operations[0]['block_num']
+        self._process_operations(operations)
+        metrics.inc('datascraper_blocks_total', stage='processed', direction=direction(self.reversed_mode))
+        metrics.inc('datascraper_operations_total', len(operations), stage='processed',
+                    direction=direction(self.reversed_mode))
 
-    def run(self):
-        logger.debug('Running {}'.format(self.name))
-        self.mongo = MongoStorage(self.config.mongo_uri)
+        self.processed_blocks.append((int(block_number), block_obj, self.block_seq))
+        if len(self.processed_blocks) >= self.config.bulk_write_blocks:
+            self._flush(force_ack=False)
+
+    def _flush(self, force_ack: bool = True):
+        """Writes buffered operations of processed blocks and only then reports these blocks as finished.
+        Unless `force_ack` is set, finished blocks are reported at most once per `ack_interval` seconds."""
+        self._run_scheduled_updates()
+        if self.bulk_writer and len(self.bulk_writer):
+            with metrics.timer('datascraper_stage_seconds', stage='write', direction=direction(self.reversed_mode)):
+                self.bulk_writer.flush()
+        publish_updates(self.redis_obj, self.identifier_updates)
+        self.identifier_updates.clear()
+        self.written_blocks.extend(self.processed_blocks)
+        self.processed_blocks.clear()
+        if force_ack or time.monotonic() - self._acked_at >= self.config.ack_interval:
+            self._ack()
+        metrics.maybe_flush()
 
-        while True:
+    def _ack(self):
+        # Blocks with scheduled updates wait for them, they are claimed until then
+        completed_seq = self.completed_seq()
+        blocks = [block for block in self.written_blocks if block[2] <= completed_seq]
+        if not blocks:
+            return
+        # Blocks claimed from the queue are removed from the processing list together with pending blocks
+        complete_blocks(self.redis_obj, self.redis_result_obj, self.redis_list_name,
+                        [block_number for block_number, _, _ in blocks],
+                        self.processing_list_name,
+                        [block_obj for _, block_obj, _ in blocks] if self.config.blocking_queue else [])
+        del self.written_blocks[:len(blocks)]
+        self._acked_at = time.monotonic()
+
+    def _finish(self):
+        """Runs all scheduled updates, writes them and reports all processed blocks, is called before exit."""
+        self._run_scheduled_updates(force=True)
+        self._flush()
+
+    @property
+    def processing_list_name(self) -> str:
+        return '{list}:processing:{name}'.format(list=self.redis_list_name, name=self.name)
+
+    def _requeue_claimed_blocks(self):
+        """Returns blocks claimed by previous run of this worker back to the queue."""
+        number = requeue_claimed_blocks(self.redis_obj, self.processing_list_name, self.redis_list_name)
+        if number:
+            logger.info('%s blocks claimed by previous run of %s are returned to "%s".',
+                        number, self.name, self.redis_list_name)
+
+    @property
+    def is_stopping(self) -> bool:
+        return self._signalled or (self.stop_event is not None and self.stop_event.is_set())
+
+    def _run_blocking(self):
+        self._requeue_claimed_blocks()
+        timeout = max(1, int(self.polling_freq))
+        while not self.is_stopping:
+            # Block is atomically moved to the processing list of this worker
+            # and stays there until its data is written to database
+            block_obj = self.redis_obj.brpoplpush(self.redis_list_name, self.processing_list_name, timeout=timeout)
+            if block_obj is None:
+                self._flush()
+                continue
+            self._process_block(block_obj)
+
+    def _run_polling(self):
+        while not self.is_stopping:
             if self.redis_obj.llen(self.redis_list_name):
                 try:
                     self._process_block(self.redis_obj.rpop(self.redis_list_name))
@@ -233,4 +444,38 @@ class WorkerProcess(multiprocessing.Process):
                                                     size=self.redis_obj.llen(self.redis_list_name),
                                                     list=self.redis_list_name))
             else:
+                self._flush()
                 time.sleep(self.polling_freq)
+
+    def _handle_signal(self, signum, frame):
+        self._signalled = True
+
+    def run(self):
+        logger.debug('Running {}'.format(self.name))
+        # Processed blocks are written and reported before exit
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        resources.configure(self.config)
+        # Clients are created in this process unless they are passed, e.g. by benchmarks
+        if self.redis_obj is None:
+            self.redis_obj = resources.redis(self.redis_list_name)
+        if self.redis_result_obj is None:
+            self.redis_result_obj = resources.redis('result_db')
+        self.mongo = resources.mongo()
+        self.bulk_writer = BulkWriter(self.mongo)
+        self.notifier.mongo = self.mongo
+        metrics.configure(self.redis_obj, self.config.metrics.flush_interval)
+        metrics.track(lambda: cache_series('ownership', self.ownership_cache))
+        metrics.track(lambda: cache_series('post', self.post_cache))
+        metrics.track(lambda: cache_series('post_index', self.post_index))
+        metrics.track(resources.connection_series)
+        if self.config.notification.send:
+            self.notifier.start()
+
+        if self.config.blocking_queue:
+            self._run_blocking()
+        else:
+            self._run_polling()
+        self._finish()
+        self.notifier.stop(self.config.notification.drain_timeout)
+        metrics.flush()
+        logger.info('%s is stopped.', self.name)
@@ -0,0 +1,153 @@
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from benchmarks.fake_notification import FakeNotificationServer
+from datascraper.cache import PostIndex, PostInfo
+from datascraper.config import Object
+from datascraper.dispatcher import NotificationDispatcher
+
+
+def make_options(url: str, **options) -> Object:
+    values = dict(url=url, token='token', events={'transfer': 'TransferEvent', 'vote': 'VoteEvent'}, send=True,
+                  timeout=5, queue_size=100, batch_size=1, batch_interval=5, max_attempts=3, backoff=0.01,
+                  index_size=100, index_ttl=60)
+    values.update(options)
+    return Object(**values)
+
+
+def make_transfer(index: int) -> dict:
+    return {'type': 'transfer', 'from': 'user%s' % index, 'to': 'steepshot', 'amount': '1.000 STEEM',
+            'memo': '', 'timestamp': datetime.utcnow(), 'block_num': index}
+
+
+class NotificationDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+
+    def start_server(self, **options) -> FakeNotificationServer:
+        self.server = FakeNotificationServer(**options).start()
+        return self.server
+
+    def make_dispatcher(self, start: bool = True, index: PostIndex = None, **options) -> NotificationDispatcher:
+        dispatcher = NotificationDispatcher(make_options(self.server.url, **options), index)
+        if start:
+            dispatcher.start()
+        return dispatcher
+
+    def test_delivers_synchronously_until_started(self):
+        self.start_server()
+        dispatcher = self.make_dispatcher(start=False)
+
+        dispatcher.submit(make_transfer(1))
+
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(dispatcher.sent, 1)
+
+    def test_batches(self):
+        self.start_server()
+        dispatcher = self.make_dispatcher(batch_size=3)
+
+        for index in range(7):
+            dispatcher.submit(make_transfer(index))
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual([notification['initiator'] for notification in self.server.notifications],
+                         ['user%s' % index for index in range(7)])
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(dispatcher.sent, 7)
+
+    def test_retries_server_errors(self):
+        self.start_server(failures=2)
+        dispatcher = self.make_dispatcher()
+
+        dispatcher.submit(make_transfer(1))
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.notifications), 1)
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (1, 0))
+
+    def test_gives_up_after_max_attempts(self):
+        self.start_server(failures=5)
+        dispatcher = self.make_dispatcher(max_attempts=2)
+
+        dispatcher.submit(make_transfer(1))
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (0, 1))
+
+    def test_doesnt_retry_client_errors(self):
+        self.start_server(failures=1, failure_status=400)
+        dispatcher = self.make_dispatcher()
+
+        dispatcher.submit(make_transfer(1))
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (0, 1))
+
+    def test_drains_queue_on_stop(self):
+        self.start_server(latency=0.05)
+        dispatcher = self.make_dispatcher()
+
+        for index in range(5):
+            dispatcher.submit(make_transfer(index))
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual(len(self.server.notifications), 5)
+        self.assertFalse(dispatcher.is_running)
+
+    def test_stop_times_out(self):
+        self.start_server(latency=0.5)
+        dispatcher = self.make_dispatcher()
+
+        for index in range(5):
+            dispatcher.submit(make_transfer(index))
+
+        self.assertFalse(dispatcher.stop(timeout=0.1))
+        self.assertLess(len(self.server.notifications), 5)
+        # Queued events are still delivered
+        self.assertTrue(dispatcher.stop(timeout=10))
+        self.assertEqual(len(self.server.notifications), 5)
+
+    def test_drops_events_when_queue_is_full(self):
+        self.start_server()
+        dispatcher = self.make_dispatcher(start=False, queue_size=2)
+        # The thread isn't started, so nothing is taken from the queue
+        with mock.patch.object(NotificationDispatcher, 'is_running', True):
+            for index in range(3):
+                dispatcher.submit(make_transfer(index))
+
+        self.assertEqual(dispatcher.stats(), {'queued': 2, 'sent': 0, 'failed': 0, 'dropped': 1})
+
+    def test_builds_events_on_submitting_thread(self):
+        self.start_server()
+        index = PostIndex()
+        index.set('@author/post', PostInfo(False, '@author/post'))
+        dispatcher = self.make_dispatcher(index=index)
+        threads = []
+
+        def get_post_info(identifier, mongo=None, index=None):
+            threads.append(threading.current_thread())
+            return index.get(identifier)
+
+        with mock.patch('datascraper.notification.get_post_info', get_post_info):
+            dispatcher.submit({'type': 'vote', 'voter': 'voter', 'author': 'author', 'permlink': 'post',
+                               'weight': 10000, 'timestamp': datetime.utcnow(), 'block_num': 1})
+        self.assertTrue(dispatcher.stop(timeout=10))
+
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(self.server.notifications, [
+            {'event_type': 'upvote', 'initiator': 'voter', 'action_object': '@author/post'}
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
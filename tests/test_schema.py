@@ -0,0 +1,138 @@
+import unittest
+from copy import deepcopy
+from datetime import datetime
+
+try:
+    from cerberus import Validator
+except ImportError:
+    Validator = None
+
+from datascraper.schema import POST_SCHEMA, FastValidator
+
+
+def make_post(votes: int = 3) -> dict:
+    created = datetime(2018, 1, 1)
+    amount = {'amount': 1.5, 'asset': 'SBD'}
+    return {
+        'identifier': '@author/post', 'author': 'author', 'permlink': 'post', 'category': 'photo',
+        'parent_author': '', 'parent_permlink': 'photo', 'title': 'Post',
+        'body': '![image](https://example.com/1.jpg)',
+        'json_metadata': {'tags': ['photo', 'steepshot'], 'app': 'steepshot/0.1'},
+        'created': created, 'last_update': created, 'active': created, 'last_payout': created,
+        'cashout_time': created, 'max_cashout_time': created,
+        'depth': '0', 'children': '3', 'net_rshares': '123456789', 'vote_rshares': '123456789',
+        'children_abs_rshares': '0', 'total_vote_weight': '1000', 'reward_weight': '10000', 'author_rewards': '0',
+        'net_votes': str(votes), 'id': '1', 'root_comment': '1', 'percent_steem_dollars': '10000',
+        'body_length': '100', 'author_reputation': '123456789', 'score_trending': 1.0, 'score_hot': 1.0,
+        'total_payout_value': amount, 'curator_payout_value': amount, 'pending_payout_value': amount,
+        'total_pending_payout_value': amount, 'promoted': amount, 'max_accepted_payout': amount,
+        'allow_replies': True, 'allow_votes': True, 'allow_curation_rewards': True,
+        'beneficiaries': [{'account': 'steepshot', 'weight': '1000'}],
+        'replies': [], 'reblogged_by': [], 'tags': ['photo', 'steepshot'],
+        'root_title': 'Post', 'url': '/photo/@author/post',
+        'active_votes': [{'voter': 'voter%s' % vote, 'weight': str(vote), 'rshares': str(vote * 1000),
+                          'percent': '10000', 'reputation': str(vote * 10), 'time': '2018-01-01T00:00:00'}
+                         for vote in range(votes)],
+    }
+
+
+class PostObject(dict):
+    """Stands for `Post` of steem library, which is a dict with attributes."""
+
+    def is_main_post(self) -> bool:
+        return not self.get('parent_author')
+
+
+@unittest.skipIf(Validator is None, 'cerberus is not installed')
+class FastValidatorParityTest(unittest.TestCase):
+    """FastValidator must give the same result and document as Cerberus and report errors of the same fields."""
+
+    def assert_parity(self, post):
+        cerberus = Validator(POST_SCHEMA, allow_unknown=True)
+        fast = FastValidator(POST_SCHEMA)
+        original = deepcopy(post)
+
+        expected = cerberus.validate(post)
+        actual = fast.validate(post)
+
+        self.assertEqual(expected, actual, 'cerberus errors: %s, fast errors: %s' % (cerberus.errors, fast.errors))
+        self.assertEqual(set(cerberus.errors), set(fast.errors))
+        if expected:
+            self.assertEqual(cerberus.document, fast.document)
+            self.assertEqual(fast.validated(post), cerberus.validated(post))
+        self.assertEqual(post, original, 'document must not be changed by validation')
+
+    def make_post(self, **fields):
+        post = make_post()
+        post.update(fields)
+        return post
+
+    def test_valid_post(self):
+        self.assert_parity(self.make_post())
+
+    def test_post_object(self):
+        self.assert_parity(PostObject(self.make_post()))
+
+    def test_post_without_optional_fields(self):
+        self.assert_parity({'identifier': '@author/post', 'author': 'author'})
+
+    def test_unknown_fields(self):
+        self.assert_parity(self.make_post(unknown_field={'nested': [1]},
+                                          json_metadata={'app': 'steepshot', 'format': 'md'}))
+
+    def test_coercion(self):
+        self.assert_parity(self.make_post(depth=1.9, children='7', net_rshares=12, id=True))
+
+    def test_coercion_failures(self):
+        for field, value in [('depth', 'abc'), ('net_rshares', 'rshares'), ('children', None),
+                             ('percent_steem_dollars', [1]), ('id', '1.5')]:
+            with self.subTest(field=field, value=value):
+                self.assert_parity(self.make_post(**{field: value}))
+
+    def test_empty_values(self):
+        for field, value in [('title', ''), ('parent_author', ''), ('tags', []), ('body', ''),
+                             ('json_metadata', {'tags': []}), ('replies', [])]:
+            with self.subTest(field=field, value=value):
+                self.assert_parity(self.make_post(**{field: value}))
+
+    def test_none_values(self):
+        for field in ['title', 'tags', 'created', 'total_payout_value', 'json_metadata', 'score_hot']:
+            with self.subTest(field=field):
+                self.assert_parity(self.make_post(**{field: None}))
+
+    def test_wrong_types(self):
+        for field, value in [('created', '2018-01-01T00:00:00'), ('title', 1), ('tags', 'photo'),
+                             ('total_payout_value', '1.500 SBD'), ('score_trending', '1.0'),
+                             ('json_metadata', '{}'), ('allow_votes', 'yes')]:
+            with self.subTest(field=field, value=value):
+                self.assert_parity(self.make_post(**{field: value}))
+
+    def test_nested_dicts(self):
+        for value in [{'amount': 1, 'asset': 'SBD'}, {'amount': '1.5', 'asset': 'SBD'},
+                      {'amount': 1.5, 'asset': None}, {'amount': 1.5}, {}]:
+            with self.subTest(value=value):
+                self.assert_parity(self.make_post(total_payout_value=value))
+
+    def test_nested_list_items(self):
+        vote = {'voter': 'voter', 'weight': '1', 'rshares': '1000', 'percent': '10000',
+                'reputation': '10', 'time': '2018-01-01T00:00:00'}
+        for value in [[vote, dict(vote, weight='heavy')], [dict(vote, rshares=None)], [dict(vote, voter=1)],
+                      ['voter'], [None], [vote, vote]]:
+            with self.subTest(value=value):
+                self.assert_parity(self.make_post(active_votes=value))
+
+        for value in [[{'account': 'steepshot', 'weight': 'x'}], [{'account': None, 'weight': 1}], [1]]:
+            with self.subTest(value=value):
+                self.assert_parity(self.make_post(beneficiaries=value))
+
+        for value in [['photo', 1], ['photo', None], ['photo', '']]:
+            with self.subTest(value=value):
+                self.assert_parity(self.make_post(tags=value, reblogged_by=value))
+
+    def test_tuples(self):
+        self.assert_parity(self.make_post(tags=('photo', 'steepshot'),
+                                          beneficiaries=({'account': 'steepshot', 'weight': '1'},)))
+
+
+if __name__ == '__main__':
+    unittest.main()